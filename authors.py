@@ -2,8 +2,14 @@
 A script to handle parsing of authors.
 '''
 
+import re
+from functools import lru_cache
+
 from inspire_api import get_record
 
+INITIALS_REGEX = re.compile(r'\w\.\w\.')
+NAME_CACHE_SIZE = 20000
+
 def get_orcid_from_author(author):
     '''Get recid if you have the author.'''
 
@@ -16,3 +22,42 @@ def get_orcid_from_author(author):
         if identifier['schema'] == 'ORCID':
             return identifier['value']
     return None
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def get_name_parts(full_name):
+    '''
+    Split an INSPIRE full_name into (first_name, middle_name, last_name).
+    Last, First Middle, Jr. keeps the suffix with the forename.
+    '''
+
+    parts = full_name.rsplit(', ', 2)
+    if len(parts) == 3:
+        last_name = parts[0]
+        fore_name = parts[1] + ', ' + parts[2]
+    else:
+        last_name = full_name.split(',', 1)[0]
+        fore_name = parts[-1]
+    middle_name = None
+    if ' ' in fore_name:
+        first_name = fore_name.split(' ', 1)[0]
+        middle_name = fore_name.rsplit(' ', 1)[1]
+    elif INITIALS_REGEX.match(fore_name):
+        first_name = fore_name[:2]
+        middle_name = fore_name[2:]
+    else:
+        first_name = fore_name
+    return (first_name, middle_name, last_name)
+
+def get_author_names(paper_authors):
+    '''
+    Get (first_name, middle_name, last_name) for a list of INSPIRE authors.
+    Authors without a full_name give (None, None, None).
+    '''
+
+    names = []
+    for author in paper_authors:
+        try:
+            names.append(get_name_parts(author['full_name']))
+        except KeyError:
+            names.append((None, None, None))
+    return names
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+'''
+Regression check of authors.get_name_parts and authors.get_author_names.
+Each line of <name>.txt in GOLDEN_DIRECTORY is an INSPIRE full_name;
+the names are parsed as one author list and compared with the
+[first_name, middle_name, last_name] lines in <name>.out, which were
+written with the regex chain get_name_parts replaced.
+With -u the .out files are written instead.
+'''
+
+import argparse
+import difflib
+import json
+import os
+import sys
+
+from authors import get_author_names
+
+GOLDEN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'authors_golden')
+
+def get_golden_files():
+    '''The names of the golden inputs, without the .txt.'''
+
+    return sorted(filename[:-4] for filename in os.listdir(GOLDEN_DIRECTORY)
+                  if filename.endswith('.txt'))
+
+def check_golden_file(name, update=False):
+    '''Parse one list of names; True if it gives the expected parts.'''
+
+    with open(os.path.join(GOLDEN_DIRECTORY, name + '.txt'), 'r',
+              encoding='utf-8') as txt:
+        full_names = txt.read()[:-1].split('\n')
+    names = get_author_names([{'full_name': full_name}
+                              for full_name in full_names])
+    lines = [json.dumps(list(parts), ensure_ascii=False) for parts in names]
+    expected_file = os.path.join(GOLDEN_DIRECTORY, name + '.out')
+    if update:
+        with open(expected_file, 'w', encoding='utf-8') as expected:
+            expected.write('\n'.join(lines) + '\n')
+        return True
+    with open(expected_file, 'r', encoding='utf-8') as expected:
+        expected_lines = expected.read()[:-1].split('\n')
+    if lines == expected_lines:
+        return True
+    print(f'{name}: get_author_names differs from {name}.out')
+    for line in difflib.unified_diff(expected_lines, lines,
+                                     name + '.out', 'get_author_names',
+                                     lineterm=''):
+        print(line)
+    return False
+
+def main(update=False):
+    '''Check every golden file, exiting non-zero if any differs.'''
+
+    failed = [name for name in get_golden_files()
+              if not check_golden_file(name, update)]
+    if update:
+        print('Updated', len(get_golden_files()), 'golden files')
+        return
+    print(f'{len(get_golden_files()) - len(failed)} golden files match, '
+          f'{len(failed)} differ')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--update',
+                        help='Write the current output as the golden files',
+                        action='store_true')
+    args = parser.parse_args()
+    main(args.update)
@@ -7,6 +7,8 @@ from inspire_api_constants_private import TOKEN, YOUR_EMAIL
 
 INSPIRE_API_ENDPOINT = 'https://inspirehep.net/api'
 SIZE = '250'
+#Answer searches from the local Fermilab mirror (inspire_mirror) if possible
+MIRROR = False
 
 session = requests.Session()
 session.headers.update({'User-Agent': f'INSPIRE API Client ({YOUR_EMAIL})'})
@@ -27,6 +29,11 @@ def get_record(input_value, collection='literature'):
         print(f'get_record: unrecognized input {input_value}')
         print('  Should be INSPIRE url or recid')
         return None
+    if MIRROR and collection == 'literature':
+        from inspire_mirror import get_mirror_record
+        jrec = get_mirror_record(input_value)
+        if jrec:
+            return jrec
     response = session.get(url)
     response.raise_for_status()
     content = response.json()
@@ -34,12 +41,15 @@ def get_record(input_value, collection='literature'):
 
 
 @on_exception(expo, CONECTION_ERRORS, max_tries=10)
-def perform_inspire_collection_search(query, fields, collection='literature'):
+def perform_inspire_collection_search(query, fields, collection='literature',
+                                      metadata_only=True):
     '''Perform the search query on INSPIRE.
     Args:
         query (str): the search query to get the results for.
         fields (iterable): a list of fields to return.
         collection (str): Literature by default
+        metadata_only (bool): False yields the whole hit, with the
+            created and updated dates alongside the metadata.
     Yields:
         The total of the result and then
         dict: the json response for every record.
@@ -56,7 +66,7 @@ def perform_inspire_collection_search(query, fields, collection='literature'):
     yield content['hits']['total']
 
     for result in content['hits']['hits']:
-        yield result['metadata']
+        yield result['metadata'] if metadata_only else result
 
     while 'next' in content.get('links', {}):
         response = session.get(content['links']['next'])
@@ -64,7 +74,7 @@ def perform_inspire_collection_search(query, fields, collection='literature'):
         content = response.json()
 
         for result in content['hits']['hits']:
-            yield result['metadata']
+            yield result['metadata'] if metadata_only else result
 
 def get_result(search, fields=(), collection='literature'):
     '''Perform a search in a collection and bring back fields'''
@@ -72,6 +82,12 @@ def get_result(search, fields=(), collection='literature'):
     if isinstance(search, int) or search.isdigit():
         search = f'recid:{search}'
 
+    if MIRROR and collection == 'literature':
+        from inspire_mirror import search_mirror
+        record_list = search_mirror(search)
+        if record_list is not None:
+            return record_list
+
     records = perform_inspire_collection_search(search, fields, collection)
 
     total = next(records)
@@ -0,0 +1,403 @@
+'''
+A local mirror of the Fermilab collection at INSPIRE.
+The mirror is filled by a bulk harvest and kept current with
+date-bounded fetches of the records updated since the last refresh.
+
+Searches of the shapes our scripts build are answered from inverted
+indexes over the mirror, if they are confined to the Fermilab
+collection or to recids in the mirror, e.g.
+    recid:123 -external_system_identifiers.schema:osti
+    _collections:Fermilab report_numbers.value:Fermilab* dadd:2012->2025
+    _collections:Fermilab (doi:"10.1/a" or doi:"10.1/b")
+Anything else, e.g. doi:"10.1/a" or doi:"10.1/b", is left to the network.
+'''
+
+import argparse
+import bisect
+import datetime
+import json
+import re
+import sqlite3
+
+from inspire_api import INSPIRE_API_ENDPOINT, perform_inspire_collection_search
+
+MIRROR_FILE = 'inspire_mirror.db'
+MIRROR_SEARCH = '_collections:Fermilab'
+MIRROR_START_YEAR = 1967
+
+RECID_REGEX = re.compile(r'^(?:recid:)?(\d+)$')
+URL_REGEX = re.compile(re.escape(INSPIRE_API_ENDPOINT) + r'/literature/(\d+)$')
+TOKEN_REGEX = re.compile(r'-?\(|\)|[^\s()"]+"[^"]*"|[^\s()]+')
+DATE_RANGE_REGEX = re.compile(r'^([\d\-]+)(?:->([\d\-]+))?$')
+
+#Search keyword: (index, how the value is matched)
+SEARCH_FIELDS = {
+    'recid':('recid', 'exact'),
+    'control_number':('recid', 'exact'),
+    '_collections':('collection', 'exact'),
+    'doi':('doi', 'exact'),
+    'dois.value':('doi', 'exact'),
+    'eprint':('eprint', 'exact'),
+    'arxiv_eprints.value':('eprint', 'exact'),
+    'report_numbers.value':('report', 'exact'),
+    'external_system_identifiers.value':('esi_value', 'exact'),
+    'external_system_identifiers.schema':('esi_schema', 'exact'),
+    'urls.description':('url_description', 'phrase'),
+    'documents.description':('document_description', 'phrase'),
+    'dadd':('created', 'date'),
+    'du':('updated', 'date'),
+}
+
+MIRROR_RECORDS = None
+MIRROR_INDEXES = None
+
+def get_connection():
+    '''Open the mirror database, creating it if need be.'''
+
+    connection = sqlite3.connect(MIRROR_FILE)
+    connection.execute('CREATE TABLE IF NOT EXISTS records '
+                       '(recid INTEGER PRIMARY KEY, created TEXT, '
+                       'updated TEXT, record TEXT)')
+    connection.execute('CREATE TABLE IF NOT EXISTS state '
+                       '(key TEXT PRIMARY KEY, value TEXT)')
+    return connection
+
+def fetch_records(search):
+    '''Get full hits, with their dates, from INSPIRE over the network.'''
+
+    hits = perform_inspire_collection_search(search, (), metadata_only=False)
+    total = next(hits)
+    result = list(hits)
+    if len(result) != total:
+        print(f'Warning: {search} total={total} count={len(result)}')
+    return result
+
+def store_records(connection, hits):
+    '''Add or replace records in the mirror.'''
+
+    connection.executemany('INSERT OR REPLACE INTO records '
+                           'VALUES (?, ?, ?, ?)',
+                           ((hit['metadata']['control_number'],
+                             hit.get('created', ''), hit.get('updated', ''),
+                             json.dumps(hit['metadata'])) for hit in hits))
+
+def get_refresh_date(connection):
+    '''Date of the last harvest or refresh.'''
+
+    row = connection.execute("SELECT value FROM state "
+                             "WHERE key = 'refresh_date'").fetchone()
+    if row:
+        return row[0]
+    return None
+
+def set_refresh_date(connection, refresh_date):
+    '''Store the date the next refresh starts from.'''
+
+    connection.execute("INSERT OR REPLACE INTO state "
+                       "VALUES ('refresh_date', ?)", (refresh_date,))
+
+def harvest():
+    '''Fill the mirror with the whole Fermilab collection, year by year.'''
+
+    today = datetime.date.today()
+    connection = get_connection()
+    with connection:
+        for year in range(MIRROR_START_YEAR, today.year + 1):
+            hits = fetch_records(f'{MIRROR_SEARCH} dadd:{year}')
+            store_records(connection, hits)
+            print(year, len(hits))
+        set_refresh_date(connection, today.isoformat())
+    connection.close()
+
+def get_mirrored_recids(connection):
+    '''The recids held in the mirror.'''
+
+    return set(row[0] for row in
+               connection.execute('SELECT recid FROM records'))
+
+def fetch_departures(window, mirrored):
+    '''
+    Mirrored records updated in the window that are no longer Fermilab
+    records, having been moved out of the collection or deleted.
+    '''
+
+    departed = set()
+    for search in (f'du:{window} -{MIRROR_SEARCH}',
+                   f'du:{window} deleted:true'):
+        hits = perform_inspire_collection_search(search, ('control_number',))
+        next(hits)
+        for hit in hits:
+            if hit['control_number'] in mirrored:
+                departed.add(hit['control_number'])
+    return departed
+
+def drop_records(connection, recids):
+    '''Remove records from the mirror.'''
+
+    connection.executemany('DELETE FROM records WHERE recid = ?',
+                           ((recid,) for recid in recids))
+
+def refresh():
+    '''
+    Fetch the records added or updated since the last refresh and drop
+    those that have left the collection or been deleted.
+    '''
+
+    today = datetime.date.today().isoformat()
+    connection = get_connection()
+    refresh_date = get_refresh_date(connection)
+    if refresh_date is None:
+        connection.close()
+        print('No harvest found, harvesting the whole collection')
+        harvest()
+        return
+    window = f'{refresh_date}->{today}'
+    with connection:
+        hits = fetch_records(f'{MIRROR_SEARCH} du:{window}')
+        departed = set(hit['metadata']['control_number'] for hit in hits
+                       if hit['metadata'].get('deleted'))
+        store_records(connection, [hit for hit in hits
+                                   if not hit['metadata'].get('deleted')])
+        departed |= fetch_departures(window, get_mirrored_recids(connection))
+        drop_records(connection, departed)
+        set_refresh_date(connection, today)
+    connection.close()
+    print(f'Refreshed {len(hits)} records and dropped {len(departed)} '
+          f'since {refresh_date}')
+
+def add_to_index(index, key, recid):
+    '''Add recid under a lower-cased key.'''
+
+    if key:
+        index.setdefault(str(key).lower(), set()).add(recid)
+
+def build_indexes(connection):
+    '''
+    Load the mirror and build the inverted indexes.
+    Value indexes are (value -> set of recids, sorted values) pairs,
+    the sorted values serving prefix searches.
+    Date indexes are sorted (date, recid) lists.
+    '''
+
+    records = {}
+    indexes = {name:{} for name, kind in SEARCH_FIELDS.values()
+               if kind != 'date'}
+    dates = {'created':[], 'updated':[]}
+    for recid, created, updated, record in \
+        connection.execute('SELECT * FROM records'):
+        jrec = json.loads(record)
+        records[recid] = jrec
+        add_to_index(indexes['recid'], recid, recid)
+        for collection in jrec.get('_collections', []):
+            add_to_index(indexes['collection'], collection, recid)
+        for doi in jrec.get('dois', []):
+            add_to_index(indexes['doi'], doi.get('value'), recid)
+        for eprint in jrec.get('arxiv_eprints', []):
+            add_to_index(indexes['eprint'], eprint.get('value'), recid)
+        for report in jrec.get('report_numbers', []):
+            add_to_index(indexes['report'], report.get('value'), recid)
+        for identifier in jrec.get('external_system_identifiers', []):
+            add_to_index(indexes['esi_value'], identifier.get('value'), recid)
+            add_to_index(indexes['esi_schema'], identifier.get('schema'),
+                         recid)
+        for url in jrec.get('urls', []):
+            add_to_index(indexes['url_description'], url.get('description'),
+                         recid)
+        for document in jrec.get('documents', []):
+            add_to_index(indexes['document_description'],
+                         document.get('description'), recid)
+        dates['created'].append((created, recid))
+        dates['updated'].append((updated, recid))
+    for name, index in indexes.items():
+        indexes[name] = (index, sorted(index))
+    for name, date_list in dates.items():
+        date_list.sort()
+        indexes[name] = date_list
+    return records, indexes
+
+def load_mirror():
+    '''Load the mirror and its indexes on first use.'''
+
+    global MIRROR_RECORDS, MIRROR_INDEXES
+    if MIRROR_RECORDS is None:
+        connection = get_connection()
+        MIRROR_RECORDS, MIRROR_INDEXES = build_indexes(connection)
+        connection.close()
+
+def get_mirror_records():
+    '''All records in the mirror, keyed on recid.'''
+
+    load_mirror()
+    return MIRROR_RECORDS
+
+def get_mirror_record(input_value):
+    '''Get a literature record from the mirror by recid or url.'''
+
+    input_value = str(input_value)
+    match = RECID_REGEX.match(input_value) or URL_REGEX.match(input_value)
+    if not match:
+        return None
+    return get_mirror_records().get(int(match.group(1)))
+
+def match_value(index, kind, value):
+    '''Recids whose indexed value matches a search value.'''
+
+    index, keys = index
+    value = value.strip('"').lower()
+    if kind == 'phrase':
+        value = value.strip('*')
+        recids = set()
+        for key in keys:
+            if value in key:
+                recids |= index[key]
+        return recids
+    if '*' in value[:-1]:
+        raise ValueError(f'Unsupported wildcard {value}')
+    if not value.endswith('*'):
+        return set(index.get(value, ()))
+    value = value[:-1]
+    recids = set()
+    for position in range(bisect.bisect_left(keys, value), len(keys)):
+        if not keys[position].startswith(value):
+            break
+        recids |= index[keys[position]]
+    return recids
+
+def match_dates(date_list, value):
+    '''Recids with a date in A->B, or matching A, compared on the prefix.'''
+
+    match = DATE_RANGE_REGEX.match(value)
+    if not match:
+        raise ValueError(f'Unsupported date {value}')
+    lower, upper = match.group(1), match.group(2) or match.group(1)
+    start = bisect.bisect_left(date_list, (lower,))
+    end = bisect.bisect_right(date_list, (upper + '\uffff',))
+    return set(recid for _, recid in date_list[start:end])
+
+def evaluate_term(term):
+    '''Recids matching a single field:value term.'''
+
+    field, _, value = term.partition(':')
+    if not value or field.lower() not in SEARCH_FIELDS:
+        raise ValueError(f'Unsupported search term {term}')
+    name, kind = SEARCH_FIELDS[field.lower()]
+    if kind == 'date':
+        return match_dates(MIRROR_INDEXES[name], value)
+    return match_value(MIRROR_INDEXES[name], kind, value)
+
+def evaluate(tokens, position=0):
+    '''
+    Evaluate tokens from position up to a closing parenthesis.
+    Terms are ANDed, 'or' separates alternatives, '-' or 'not' negates.
+    Returns (recids, position after the last token used).
+    '''
+
+    universe = set(MIRROR_RECORDS)
+    alternatives = []
+    recids = None
+    negate = False
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token == ')':
+            break
+        if token.lower() == 'and':
+            continue
+        if token.lower() == 'or':
+            alternatives.append(universe if recids is None else recids)
+            recids = None
+            continue
+        if token.lower() == 'not':
+            negate = True
+            continue
+        if token.startswith('-'):
+            negate = True
+            token = token[1:]
+        if token == '(':
+            term_recids, position = evaluate(tokens, position)
+        else:
+            term_recids = evaluate_term(token)
+        if negate:
+            term_recids = universe - term_recids
+            negate = False
+        recids = term_recids if recids is None else recids & term_recids
+    alternatives.append(universe if recids is None else recids)
+    return set().union(*alternatives), position
+
+def is_mirror_term(token):
+    '''
+    Whether a term confines a search to records the mirror holds:
+    the mirrored collection or recids that are all in the mirror.
+    '''
+
+    field, _, value = token.partition(':')
+    value = value.strip('"').lower()
+    if token.lower() == MIRROR_SEARCH.lower():
+        return True
+    if SEARCH_FIELDS.get(field.lower()) == ('recid', 'exact'):
+        return value.isdigit() and int(value) in MIRROR_RECORDS
+    return False
+
+def is_mirror_search(tokens):
+    '''
+    Whether the mirror can answer a search in full. Every alternative
+    at the top level must be ANDed with a term that is not negated and
+    that confines it to the mirror.
+    '''
+
+    depth = 0
+    confined = False
+    negate = False
+    for token in tokens:
+        if token.endswith('('):
+            depth += 1
+        elif token == ')':
+            depth -= 1
+        elif depth:
+            continue
+        elif token.lower() == 'or':
+            if not confined:
+                return False
+            confined = False
+        elif token.lower() == 'not':
+            negate = True
+            continue
+        elif not negate and not token.startswith('-') and \
+             is_mirror_term(token):
+            confined = True
+        negate = False
+    return confined
+
+def search_mirror(search):
+    '''
+    Answer a search from the mirror, most recent recid first.
+    The mirror only holds the Fermilab collection, so only searches
+    confined to it, by _collections:Fermilab or by recids found in the
+    mirror, are answered. Returns None for anything else.
+    '''
+
+    search = search.strip()
+    tokens = TOKEN_REGEX.findall(search)
+    load_mirror()
+    if not is_mirror_search(tokens):
+        return None
+    try:
+        recids, _ = evaluate(tokens)
+    except ValueError:
+        return None
+    return [MIRROR_RECORDS[recid] for recid in sorted(recids, reverse=True)]
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--full',
+                        help='Harvest the whole collection again',
+                        action='store_true')
+    args = parser.parse_args()
+    try:
+        if args.full:
+            harvest()
+        else:
+            refresh()
+    except KeyboardInterrupt:
+        print('Exiting')
@@ -4,20 +4,29 @@
 A system to extract collaboration author lists from tex files or ieee.
 """
 
+import contextlib
+import gzip
+from html import escape
+import io
 import json
 import getopt
 import os
 import re
+import sqlite3
 import sys
 import tarfile
 import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
-import arxiv
 import requests
+from requests.adapters import HTTPAdapter
 from pylatexenc.latex2text import LatexNodes2Text
 from unidecode import unidecode
 
 from inspire_api import get_result_ids
+from lit_collaboration_authors_constants import AUTHOR_NAME_OVERRIDES
 
 EMAIL_REGEX = re.compile(r"^[\w\-\.\'\+]+@[\w\-\.]+\.\w{2,4}$")
 ORCID_REGEX = re.compile(r'^0000-\d{4}-\d{4}-\d{3}[\dX]$')
@@ -27,135 +36,559 @@ INSPIRE_REGEX = re.compile(r'^INSPIRE-\d{8}$')
 AFFILIATIONS_DONE = {}
 
 DIRECTORY = '/tmp/'
+BIB = DAT = TEST = VERBOSE = False
+#Format of the author list written out, json or xml (MARCXML)
+OUTPUT_FORMAT = 'json'
+ARXIV_SOURCE_URL = 'https://arxiv.org/e-print/'
+SOURCE_TIMEOUT = 60
+#Raw arXiv sources already read in this run, keyed on eprint (and version)
+SOURCE_CACHE = {}
+#Downloaded sources, by eprint and version, up to a total size in bytes
+SOURCE_DIRECTORY = DIRECTORY + 'arxiv_sources/'
+SOURCE_DIRECTORY_SIZE = 1024 ** 3
+#A directory of pre-fetched sources to work from offline
+SOURCE_MIRROR = None
+SOURCE_VERSION_REGEX = re.compile(r'\d(v\d+)')
+EPRINT_VERSION_REGEX = re.compile(r'v\d+$')
+SOURCE_FILE_REGEX = re.compile(r'^.*(tex|xml|txt)$')
+SOURCE_FILE_BIB_REGEX = re.compile(r'^.*(tex|xml|txt|bib|bbl|inc)$')
+SOURCE_FILE_DAT_REGEX = re.compile(r'^.*(tex|xml|txt|dat)$')
+#Papers processed at the same time in batch mode
+BATCH_WORKERS = 4
+
+IEEE_DOI_URL = 'http://dx.doi.org/'
+IEEE_TIMEOUT = 60
+#IEEE pages fetched at the same time in batch mode
+IEEE_WORKERS = 8
+IEEE_METADATA_REGEX = \
+    re.compile(r'^[ \t]*global\.document\.metadata=(\{.*?\});\r?$',
+               re.MULTILINE)
+IEEE_EMAIL_REGEX = re.compile(r'(.*) \(e\-mail: (.*)\)')
+#IEEE metadata already fetched in this run, keyed on url
+IEEE_METADATA = {}
+IEEE_SESSION = requests.Session()
+IEEE_SESSION.mount('http://', HTTPAdapter(pool_maxsize=IEEE_WORKERS))
+IEEE_SESSION.mount('https://', HTTPAdapter(pool_maxsize=IEEE_WORKERS))
+
+#Text with none of these is left unchanged by pylatexenc
+LATEX_CHARACTERS = frozenset('\\{}$%~&#^_')
+LATEX_LIGATURES = ('--', '``', "''", '!`', '?`')
+LATEX_CACHE_SIZE = 20000
+LATEX_CONVERTER = LatexNodes2Text()
+
+#Author name normalisation
+NAME_CACHE_SIZE = 20000
+NAME_CJK_REGEX = \
+    re.compile(r'\s*\\\\begin{CJK\*}{UTF8}{gkai}\((.*)\)\\\\end{CJK\*}')
+NAME_CHNAME_REGEX = re.compile(r'\(chname\{(.*)\}\)')
+NAME_COMMA_REGEX = re.compile(r'\,\s*')
+NAME_INITIALS_REGEX = re.compile(r'\. [^\.]+$')
+NAME_INITIALS_SUB_REGEX = re.compile(r'(.*\.) ([^\.]+)')
+NAME_TWO_PARTS_REGEX = re.compile(r'^\S+ \S+$')
+NAME_LAST_PART_REGEX = re.compile(r'(.*) (.*)')
+NAME_PART_REGEX = re.compile(r' (\w+)')
+NAME_PARTICLES = ('Da', 'De', 'Del', 'Della', 'Van', 'Von')
+NAME_ALLCAPS_REGEX = re.compile(r'[A-Z][A-Z]')
+NAME_NUMERAL_REGEX = re.compile(r'I[IV]+')
+NAME_SUFFIX_REGEX = re.compile(r'^(.*\w) ([IVJr\.]{2,}$)')
+NAME_PARENTHESES_REGEX = re.compile(r'(.*) (\(.*\))')
+#Before the LaTeX is converted
+NAME_RULES_LATEX = [
+    ('Inspire', 'INSPIRE'),
+    (r'\.', r'xxxx'),
+    (r'.', '. '),
+    (r'xxxx', r'\.'),
+    (re.compile('[ ]+'), ' '),
+    (re.compile(r'\\(cor|corauth|fn)ref\{\w+\}'), r''),
+    (re.compile(r'\}?\\thanks\{\\?.*\}?'), r''),
+    (r'\,', r'~'),
+    (r'\~', r'xxxx'),
+    (r'~', r' '),
+    (r'xxxx', r'\~'),
+]
+#After it is converted
+NAME_RULES_TEXT = [
+    (',', ', '),
+    ('.', '. '),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\s+$'), ''),
+    (re.compile(r'^\s+'), ''),
+]
+#Once the name is in Last, First form
+NAME_RULES_INSPIRE = [
+    (',', ', '),
+    (re.compile(r'\.\s+'), '.'),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\s+$'), ''),
+    (re.compile(r'^\s+'), ''),
+]
+
+#Author ids, found in names or given as a whole affiliation
+AUTHOR_ID_REGEX = \
+    re.compile(r'(?:https?://orcid\.org/)?'
+               r'(?P<ORCID>0000-\d{4}-\d{4}-\d{3}[\dX])'
+               r'|(?P<INSPIRE>INSPIRE-\d{8})'
+               r"|(?P<EMAIL>[\w\-\.\'\+]+@[\w\-\.]+\.\w{2,4})")
+WHITESPACE_REGEX = re.compile(r'\s+')
+#Affiliation cleaning, before and after the LaTeX is converted
+AFFILIATION_RULES_LATEX = [
+    (re.compile(r'\\affinfn{(.*)}{(.*)}'), r'INFN \1 \2'),
+    (re.compile(r'\\affuni{(.*)}{(.*)}'), r'\1 University \2'),
+]
+AFFILIATION_RULES_TEXT = [
+    (re.compile(r'([\.\,]+)'), r'\1 '),
+    (WHITESPACE_REGEX, ' '),
+    (re.compile(r'\s$'), r''),
+    (re.compile(r'\s*also at[\:\s]*', re.IGNORECASE), r''),
+    (re.compile(r'\s*\\and$'), r''),
+    ('[]', ''),
+]
+AFFILIATION_KEY_REGEX = re.compile(r'\W+')
+#How each kind of author id is written out
+INSPIRE_ID_SCHEMAS = {'ORCID':'ORCID', 'INSPIRE':'INSPIRE ID'}
+MARC_ID_SUBFIELDS = {'ORCID':('j', 'ORCID:'), 'INSPIRE':('i', ''),
+                     'EMAIL':('m', 'email:')}
+
+#Line rules of preprocess_file
+NEWCOMMAND_REGEX = re.compile(r'\\r?e?newcommand\*?\{\\(\w+)\}\{(.*)\}')
+DEF_REGEX = re.compile(r'\\def\\(\w+)\{(.*)\}')
+COMMAND_VALUE_REGEX = re.compile(r'^\\\w')
+AUTHOR_PARENTHESES_REGEX = re.compile(r'^[A-Z].* \(.*\)\s*$')
+AUTHOR_PARENTHESES_SUB_REGEX = re.compile(r'(.*)\s+\((.*)\)')
+AFFMARK_REGEX = re.compile(r'\\affmark\[(.*)\]')
+ADD_AUTHOR_REGEX = \
+    re.compile(r'\\AddAuthor{(.*)}{([^\}]*)}{([^\}]*)}{([^\}]*)}')
+ADD_INSTITUTE_REGEX = re.compile(r'\\AddInstitute{([^\}]+)}{')
+ADD_INSTITUTE_SUB_REGEX = re.compile(r'\\AddInstitute{([^\}]+)}')
+FIRSTNAME_INST_REGEX = \
+    re.compile(r'\\firstname{(.*)}\s*\\lastname{(.*)}\s*\\inst(\{.*\}).*')
+FIRSTNAME_REGEX = re.compile(r'\\firstname{(.*)}\s*\\lastname{(.*)}')
+INST_REGEX = re.compile(r'\\inst({[^\}]+\})')
+BABAR_AFFILIATION_REGEX = re.compile(r'\\affiliation\{.*\$\^\{?[abc]\}?\$')
+BABAR_MARK_REGEX = re.compile(r'\$\^\{?[abc]\}?\$')
+BABAR_AUTHOR_REGEX = re.compile(r'\\author\{.*\$\^\{?[abc]+\}?\$')
+BABAR_AUTHOR_MARK_REGEX = re.compile(r'[ ]*\$\^\{?[abc]+\}?\$[ ]*')
+BABAR_ALTAFFILIATION_REGEX = re.compile(r'\\author\{.*\\altaffiliation')
+ALTAFFILIATION_REGEX = re.compile(r'\\altaffiliation.*')
+ASTRO_ITEM_REGEX = re.compile(r'^\\item')
+ASTRO_GOODBREAK_REGEX = re.compile(r'(.*)[ ]*\\goodbreak[ ]*$')
+ASTRO_AND_REGEX = re.compile(r'.\\and[ ]*$')
+ASTRO_AND_SUB_REGEX = re.compile(r'(.*)[ ]*\\and[ ]*$')
+LIGO_AUTHOR_REGEX = re.compile(r"^([A-Z])[\~\.]([^-]*)([A-Z])([^A-Z]+)\s*\%\s*"
+                               r"([a-z])([a-z]+)\.([a-z])([a-z]+)")
+LIGO_AFFILIATION_REGEX = \
+    re.compile(r"\\affiliation\s*\{(.*)\}\s*\%.*(\{\d+\})")
+ABSTRACT_REGEX = re.compile('abstract', re.IGNORECASE)
+
+#Whole-document rules of preprocess_file, applied in order
+PREPROCESS_CLEANUP = [
+    #Remove spaces around braces and commas
+    (re.compile(r'[ ]*([\]\}\[\{\,])[ ]*'), r'\1'),
+    (re.compile(r'^[ ]+'), ''),
+    (re.compile(r'\-+'), r'-'),
+    (re.compile(r'%.*\n'), '\n'),
+    (re.compile(r'}\$,\s*'), '}$\n'),
+    (re.compile(r'\$\^(\w)\$,\s*'), r'$^\1$\n'),
+    (re.compile(r'\\thanks\{[^\}]+(0000-0[\d\-]+[\dX])[^\}]*\}'),
+     r'\\affiliation{\1}'),
+    (re.compile(r'\}?\\thanks\{[^\}]+\}?'), r''),
+    (re.compile(r'\\item\[(\$\^\{?\w+\}?\$)\]'), r'\1'),
+    (re.compile(r'\\llap\{(\$\S+\$)\}'), r'\1 '),
+    (re.compile(r'\\textsuperscript\{([a-z\d\,]+)\}\{'), r'$^{\1$} \{'),
+    (re.compile(r'\\textsuperscript\{([a-z\d\,]+)\}'), r'$^{\1$}\n'),
+    (re.compile(r'\\address'), r'\\affiliation'),
+    (re.compile(r'\\affil\b'), r'\\affiliation'),
+    (re.compile(r'\\email\{'), r'\\affiliation{'),
+    (re.compile(r'}\s*\\affiliation'), '}\n\\\\affiliation'),
+    (re.compile(r'}\s*\\author'), '}\n\\\\author'),
+    (re.compile(r'[ ]*\\scriptsize[ ]+'), ''),
+    (re.compile(r'\\and[ ]+'), ''),
+    (re.compile(r'\$\s*\^'), '$^'),
+]
+PREPROCESS_REFERENCES = [
+    (re.compile(r'Irefn{(\w+)}\\Aref{(\w+)}\\Aref{(\w+)}'),
+     r'Irefn{\1,\2,\3}'),
+    (re.compile(r'Irefn+\{(.*)\}\\?A?r?e?f?s?\{(.*)\}'), r'Irefn{\1,\2}'),
+    (re.compile(r'Arefs?{(\w+)}'), r'Irefn{\1}'),
+    (re.compile(r'\\Idef{(\w+)}'), r'$^{\1}$'),
+    (re.compile(r'[ \,]*\\(inst|altaffilmark|Irefn|thanksref)\{([^\}]+)\}'),
+     r'$^{\2}$'),
+    #\altaffiltext{2}{Fermilab, Batavia}
+    (re.compile(r'\\(altaffiltext|thankstext)\{([\w\,\-]+)\}\{(.*)\}'),
+     r'$^{\2}$ \3'),
+    (re.compile(r'\\item\s*\\[IA]def\{([\w\,\-]+)\}\{(.*)\}'), r'$^{\1}$ \2'),
+    (re.compile(r'\\[IA]def\{([\w\,\-]+)\}\{(.*)\}'), r'$^{\1}$ \2'),
+    (re.compile(r'(.*)\s*\\label\{(.*)\}'), r'$^{\2}$ \1'),
+    #\author[b,c]{M. Zimmermann} \affiliation[b]{Fermilab}
+    (re.compile(r'\\author\[([\w\,\-]+)\]\{(.*)\}'), r'\2$^{\1}$'),
+    (re.compile(r'\\affiliation\[([\w\,\-]+)\]\{(.*)\}'), r'$^{\1}$ \2'),
+    #\author{M. Zimmermann$^{b,c}$} \affiliation{$^{b}$Fermilab} remove \author
+    (re.compile(r'\\author\{(.*\$\^\{?[\w\,\-]+\}?\$)\}'), r'\1'),
+    (re.compile(r'\\affiliation\{(\$\^\{?[\w\,\-]+\}?\$.*)\}'), r'\1'),
+    (re.compile(r'[\, ]+\}'), '}'),
+    (re.compile(r'[\, ]+\$\^'), '$^'),
+]
+
+#Normalised affiliations kept between runs, shared by concurrent runs
+AFFILIATION_CACHE_FILE = DIRECTORY + 'lit_collaboration_affiliations.db'
+AFFILIATION_CACHE_SIZE = 100000
+AFFILIATION_CACHE_TIMEOUT = 60
+AFFILIATION_CACHE = None
+AFFILIATION_STATS = Counter()
+
+def get_affiliation_cache():
+    """Open the affiliation cache, creating it if need be."""
+
+    global AFFILIATION_CACHE
+    if AFFILIATION_CACHE is None:
+        AFFILIATION_CACHE = sqlite3.connect(AFFILIATION_CACHE_FILE,
+                                            timeout=AFFILIATION_CACHE_TIMEOUT)
+        AFFILIATION_CACHE.execute('PRAGMA journal_mode=WAL')
+        AFFILIATION_CACHE.execute('CREATE TABLE IF NOT EXISTS affiliations '
+                                  '(key TEXT PRIMARY KEY, value TEXT, '
+                                  'used REAL)')
+    return AFFILIATION_CACHE
+
+def get_cached_affiliation(affiliation_key):
+    """The normalised form of an affiliation seen before, or None."""
+
+    if affiliation_key in AFFILIATIONS_DONE:
+        AFFILIATION_STATS['hits'] += 1
+        return AFFILIATIONS_DONE[affiliation_key]
+    value = None
+    if not TEST:
+        connection = get_affiliation_cache()
+        with connection:
+            row = connection.execute('SELECT value FROM affiliations '
+                                     'WHERE key = ?',
+                                     (affiliation_key,)).fetchone()
+            if row:
+                value = row[0]
+                connection.execute('UPDATE affiliations SET used = ? '
+                                   'WHERE key = ?',
+                                   (time.time(), affiliation_key))
+    if value is None:
+        AFFILIATION_STATS['misses'] += 1
+        return None
+    AFFILIATION_STATS['hits'] += 1
+    AFFILIATIONS_DONE[affiliation_key] = value
+    return value
+
+def store_affiliation(affiliation_key, value):
+    """Keep a normalised affiliation for this and later runs."""
+
+    AFFILIATIONS_DONE[affiliation_key] = value
+    connection = get_affiliation_cache()
+    with connection:
+        connection.execute('INSERT OR REPLACE INTO affiliations '
+                           'VALUES (?, ?, ?)',
+                           (affiliation_key, value, time.time()))
+
+def close_affiliation_cache():
+    """Evict the least recently used affiliations and report the hits."""
+
+    global AFFILIATION_CACHE
+    if AFFILIATION_CACHE is not None:
+        with AFFILIATION_CACHE:
+            AFFILIATION_CACHE.execute('DELETE FROM affiliations WHERE key '
+                                      'NOT IN (SELECT key FROM affiliations '
+                                      'ORDER BY used DESC LIMIT ?)',
+                                      (AFFILIATION_CACHE_SIZE,))
+        AFFILIATION_CACHE.close()
+        AFFILIATION_CACHE = None
+    if AFFILIATION_STATS:
+        print('Affiliation cache: {0} hits, {1} misses'.format(
+              AFFILIATION_STATS['hits'], AFFILIATION_STATS['misses']))
+        AFFILIATION_STATS.clear()
+
+def find_source_file(directory, eprint):
+    """
+    The path of a source of eprint in directory, or None.
+    Files are named after the eprint and version, e.g. 2012.06888v2 or
+    hep-ex-0101001v1.tar.gz; without a version the newest is taken.
+    """
 
-def download_source(eprint='2012.06888', bib=False, dat=False):
-    """Download a tar file from arXiv and choose the right file."""
+    if not directory or not os.path.isdir(directory):
+        return None
+    pattern = re.compile(re.escape(eprint.replace('/', '-')) +
+                         r'(v\d+)?(\.[\w\.]+)?$')
+    source_file = None
+    source_version = -1
+    for filename in os.listdir(directory):
+        match = pattern.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1)[1:]) if match.group(1) else 0
+        if version > source_version:
+            source_file = filename
+            source_version = version
+    if source_file:
+        return os.path.join(directory, source_file)
+    return None
+
+def store_source(eprint, source, disposition):
+    """
+    Keep a downloaded source in SOURCE_DIRECTORY under its version,
+    then evict the least recently used sources beyond the size limit.
+    """
 
     filename = eprint.replace('/', '-')
-    paper = arxiv.query(id_list=[eprint])[0]
-    paper = arxiv.download(paper, prefer_source_tarfile=True)
-    this_tarfile = tarfile.open(paper, 'r')
+    match = SOURCE_VERSION_REGEX.search(disposition)
+    if match and not EPRINT_VERSION_REGEX.search(eprint):
+        filename += match.group(1)
+    os.makedirs(SOURCE_DIRECTORY, exist_ok=True)
+    temporary = os.path.join(SOURCE_DIRECTORY,
+                             f'.tmp-{filename}-{os.getpid()}')
+    with open(temporary, 'wb') as output:
+        output.write(source)
+    os.replace(temporary, os.path.join(SOURCE_DIRECTORY, filename))
+
+    sources = []
+    for entry in os.scandir(SOURCE_DIRECTORY):
+        if entry.is_file() and not entry.name.startswith('.tmp-'):
+            stat = entry.stat()
+            sources.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in sources)
+    for _, size, path in sorted(sources):
+        if total <= SOURCE_DIRECTORY_SIZE:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def get_current_version(eprint):
+    """
+    The current version of an eprint, e.g. v3, from the
+    Content-Disposition arXiv sends, or None if arXiv does not say.
+    """
+
+    response = requests.head(ARXIV_SOURCE_URL + eprint,
+                             timeout=SOURCE_TIMEOUT, allow_redirects=True)
+    response.raise_for_status()
+    match = SOURCE_VERSION_REGEX.search(
+        response.headers.get('Content-Disposition', ''))
+    if match:
+        return match.group(1)
+    return None
+
+def find_cached_source(eprint):
+    """
+    The path of the source of eprint in SOURCE_DIRECTORY, or None.
+    Without a version the newest cached one may have been replaced on
+    arXiv, so only the current version is taken, unless arXiv cannot
+    be asked which that is.
+    """
+
+    if EPRINT_VERSION_REGEX.search(eprint):
+        return find_source_file(SOURCE_DIRECTORY, eprint)
+    try:
+        version = get_current_version(eprint)
+    except requests.exceptions.RequestException as err:
+        print('Cannot find the current version of', eprint, err)
+        return find_source_file(SOURCE_DIRECTORY, eprint)
+    if version:
+        return find_source_file(SOURCE_DIRECTORY, eprint + version)
+    return None
+
+def get_source(eprint):
+    """
+    The raw arXiv source of an eprint, from this run, the offline
+    SOURCE_MIRROR or SOURCE_DIRECTORY if there, otherwise from arXiv.
+    Offline, an eprint that is not in the mirror gives None.
+    """
+
+    if eprint in SOURCE_CACHE:
+        return SOURCE_CACHE[eprint]
+    if SOURCE_MIRROR:
+        path = find_source_file(SOURCE_MIRROR, eprint) or \
+               find_source_file(SOURCE_DIRECTORY, eprint)
+    else:
+        path = find_cached_source(eprint)
+    if path:
+        with open(path, 'rb') as input_file:
+            source = input_file.read()
+        if not SOURCE_MIRROR or not path.startswith(SOURCE_MIRROR):
+            #Mark it as recently used
+            os.utime(path)
+    elif SOURCE_MIRROR:
+        print('No source for', eprint, 'in', SOURCE_MIRROR)
+        return None
+    else:
+        response = requests.get(ARXIV_SOURCE_URL + eprint,
+                                timeout=SOURCE_TIMEOUT)
+        response.raise_for_status()
+        source = response.content
+        store_source(eprint, source,
+                     response.headers.get('Content-Disposition', ''))
+    SOURCE_CACHE[eprint] = source
+    return source
+
+def get_source_files(eprint, source):
+    """
+    The files of an arXiv source as a dictionary of name and contents.
+    The source is a (gzipped) tar file or a single gzipped file.
+    """
+
+    try:
+        with tarfile.open(fileobj=io.BytesIO(source), mode='r:*') as \
+             this_tarfile:
+            return {member.name:this_tarfile.extractfile(member).read()
+                    for member in this_tarfile.getmembers()
+                    if member.isfile()}
+    except tarfile.ReadError:
+        pass
+    try:
+        source = gzip.decompress(source)
+    except OSError:
+        pass
+    if source.startswith(b'%PDF'):
+        return {}
+    return {eprint.replace('/', '-') + '.tex':source}
+
+def decode_source(data):
+    """Text of a source file, which is not always UTF-8."""
+
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+def choose_source_file(source_files, tarfiles):
+    """
+    The key in tarfiles of the largest .tex file with \\author or
+    \\affiliation in it, or None. Used instead of asking in batch mode.
+    """
+
+    file_choice = None
+    file_size = -1
+    for key, name in sorted(tarfiles.items(), key=lambda item: item[1]):
+        if not name.endswith('.tex'):
+            continue
+        data = source_files[name]
+        if (b'\\author' in data or b'\\affiliation' in data) and \
+           len(data) > file_size:
+            file_choice = key
+            file_size = len(data)
+    return file_choice
+
+def download_source(eprint='2012.06888', bib=False, dat=False, batch=False):
+    """
+    Get the source of an eprint from arXiv and choose the right file.
+    Nothing is written to disk; the text of the file is returned.
+    """
+
+    source = get_source(eprint)
+    if source is None:
+        return None
+    source_files = get_source_files(eprint, source)
+    file_type_regex = SOURCE_FILE_REGEX
+    if bib:
+        file_type_regex = SOURCE_FILE_BIB_REGEX
+    if dat:
+        file_type_regex = SOURCE_FILE_DAT_REGEX
     tarfiles = {}
     file_count = 0
-    for this_file in this_tarfile.getnames():
-        file_type_regex = re.compile(r'^.*(tex|xml|txt)$')
-        if bib:
-            file_type_regex = re.compile(r'^.*(tex|xml|txt|bib|bbl|inc)$')
-        if dat:
-            file_type_regex = re.compile(r'^.*(tex|xml|txt|dat)$')
+    for this_file in source_files:
         if file_type_regex.match(this_file):
             file_count += 1
             tarfiles[file_count] = this_file
             print(file_count, tarfiles[file_count])
+    if file_count == 0:
+        print('No source files found for', eprint)
+        return None
     if file_count == 1:
         file_choice = file_count
+    elif batch:
+        file_choice = choose_source_file(source_files, tarfiles)
+        if file_choice is None:
+            print('No author list found in', eprint)
+            return None
     else:
         file_choice = input('Choose a file: ')
         file_choice = int(file_choice)
-    source_file = this_tarfile.extractfile(tarfiles[file_choice])
-    file_type = re.match(r'.*(\w{3})$', tarfiles[file_choice]).group(1)
-    output = open(filename + '.' + file_type, 'wb')
-    output.write(source_file.read())
-    output.close()
-    os.unlink(paper)
-    return file_type
+    return decode_source(source_files[tarfiles[file_choice]])
+
+@lru_cache(maxsize=LATEX_CACHE_SIZE)
+def latex_to_text(latex):
+    """Convert LaTeX to unicode text, remembering strings already seen."""
+
+    if LATEX_CHARACTERS.isdisjoint(latex) and \
+       not any(ligature in latex for ligature in LATEX_LIGATURES):
+        return latex
+    return LATEX_CONVERTER.latex_to_text(latex)
+
+def apply_rules(text, rules):
+    """Apply (pattern, replacement) rules in order, plain strings literally."""
+
+    for pattern, replacement in rules:
+        if isinstance(pattern, str):
+            text = text.replace(pattern, replacement)
+        else:
+            text = pattern.sub(replacement, text)
+    return text
 
 def author_first_last(author):
     """Determines the components of the author's name.."""
 
     #Handle ways for 'q'
-    qname = re.search(r'\s*\\\\begin{CJK\*}{UTF8}{gkai}\((.*)\)\\\\end{CJK\*}',
-                      author, re.U)
+    qname = NAME_CJK_REGEX.search(author)
     if not qname:
-        qname = re.search(r'\(chname\{(.*)\}\)', author, re.U)
+        qname = NAME_CHNAME_REGEX.search(author)
     if qname:
         author = author.replace(qname.group(0), u'')
         qname = ':' + qname.group(1)
     else:
         qname = ''
-    if re.search(r',', author):
-        author = re.sub(r'\,\s*', ', ', author)
+    if ',' in author:
+        author = NAME_COMMA_REGEX.sub(', ', author)
         return author + qname
-    if re.match(r'^Tatjana Agatonovic Jovin$', author):
-        return 'Agatonovic Jovin, Tatjana'
-    if re.match(r'^Ivanka Bozovic Jelisavcic$', author):
-        return 'Bozovic Jelisavcic, Ivanka'
-    if re.match(r'^Enrique Calvo Alamillo$', author):
-        return 'Calvo Alamillo, Enrique'
-    if re.match(r'^Ziad El Bitar$', author):
-        return 'El Bitar, Ziad'
-    if re.match(r'^Hector García Cabrera$', author):
-        return 'García Cabrera, Hector'
-    if re.match(r'^Amir Noori Shirazi$', author):
-        return 'Noori Shirazi, Amir'
-    if re.match(r'^Maria Soledad Robles Manzano$', author):
-        return 'Robles Manzano, Maria Soledad'
-    if re.match(r'^Antonio Verdugo de Osa$', author):
-        return 'Verdugo de Osa, Antonio'
+    if author in AUTHOR_NAME_OVERRIDES:
+        return AUTHOR_NAME_OVERRIDES[author]
     #Anything ending in a period is the firstname block
-    if re.search(r'\. [^\.]+$', author, re.U):
-        return re.sub(r'(.*\.) ([^\.]+)', r'\2, \1', author, re.U) + \
-               qname
+    if NAME_INITIALS_REGEX.search(author):
+        return NAME_INITIALS_SUB_REGEX.sub(r'\2, \1', author) + qname
     #Anything with only two parts
-    if re.search(r'^\S+ \S+$', author, re.U):
-        return re.sub(r'(.*) (.*)', r'\2, \1', author, re.U) + qname
+    if NAME_TWO_PARTS_REGEX.search(author):
+        return NAME_LAST_PART_REGEX.sub(r'\2, \1', author) + qname
     #Anything starting with a lower-case letter, e.g. Oscar de la Hoya
-    pattern = re.compile(r' (\w+)', re.U)
-    for last_guess in re.findall(pattern, author):
+    for last_guess in NAME_PART_REGEX.findall(author):
         firstname = False
-        if last_guess in ['Da', 'De', 'Del', 'Della', 'Van', 'Von']:
-            firstname = re.sub(last_guess + u'.*', '', author)
-        elif last_guess[0].lower() == last_guess[0]:
-            firstname = re.sub(last_guess + u'.*', '', author)
+        if last_guess in NAME_PARTICLES or \
+           last_guess[0].lower() == last_guess[0]:
+            firstname = author[:author.find(last_guess)]
         if firstname:
             return author.replace(firstname, '') + ',' + firstname + qname
-    match = re.match('(.*) (.*)', author, re.U)
+    match = NAME_LAST_PART_REGEX.match(author)
     if match:
         return match.group(2) + u', ' + match.group(1) + qname
     return author + qname
 
 
+@lru_cache(maxsize=NAME_CACHE_SIZE)
 def process_author_name(author):
     """Convert author to INSPIRE form."""
 
 
     #test for ALLCAPS
     author = author.replace('YYYY', '')
-    if re.search(r'[A-Z][A-Z]', author):
+    if NAME_ALLCAPS_REGEX.search(author):
         author_uplow = ''
         for part in author.split(' '):
-            if part.upper() == part and not re.match(r'I[IV]+', part):
+            if part.upper() == part and not NAME_NUMERAL_REGEX.match(part):
                 part = part.title()
             author_uplow += ' ' + part
         author = author_uplow
-    author = author.replace('Inspire', 'INSPIRE')
-
-    #print 'INPUT = ', author
-    author = author.replace(r'\.', r'xxxx')
-    author = author.replace(r'.', '. ')
-    author = author.replace(r'xxxx', r'\.')
-    author = re.sub('[ ]+', ' ', author)
-    author = re.sub(r'\\(cor|corauth|fn)ref\{\w+\}', r'', author)
-    author = re.sub(r'\}?\\thanks\{\\?.*\}?', r'', author)
-    author = author.replace(r'\,', r'~')
-    author = author.replace(r'\~', r'xxxx')
-    author = author.replace(r'~', r' ')
-    author = author.replace(r'xxxx', r'\~')
-    #print 'MIDWAY1 =', author
-    #author = translate_latex2unicode(author)
-    author = LatexNodes2Text().latex_to_text(author)
+    author = apply_rules(author, NAME_RULES_LATEX)
+    author = latex_to_text(author)
     author = author.replace('\\"i', 'ï')
     if '\\' in author and 'UTF8' not in author:
         print('Problem with', author)
         sys.exit()
-    author = author.replace(',', ', ')
-    author = author.replace('.', '. ')
-    author = re.sub(r'\s+', ' ', author)
-    author = re.sub(r'\s+$', '', author)
-    author = re.sub(r'^\s+', '', author)
-    #print 'MIDWAY2 =', author
-    match_object_1 = re.match(r'^(.*\w) ([IVJr\.]{2,}$)', author)
-    match_object_2 = re.match(r'(.*) (\(.*\))', author, re.U)
+    author = apply_rules(author, NAME_RULES_TEXT)
+    match_object_1 = NAME_SUFFIX_REGEX.match(author)
+    match_object_2 = NAME_PARENTHESES_REGEX.match(author)
     if match_object_1 or match_object_2:
         if match_object_1:
             match_object = match_object_1
@@ -165,17 +598,7 @@ def process_author_name(author):
                  match_object.group(2)
     else:
         author = author_first_last(author)
-    author = author.replace(',', ', ')
-    author = re.sub(r'\.\s+', '.', author)
-    author = re.sub(r'\s+', ' ', author)
-    author = re.sub(r'\s+$', '', author)
-    author = re.sub(r'^\s+', '', author)
-
-
-
-    #author = translate_latex2unicode(author)
-
-    #print 'OUTPUT =', author
+    author = apply_rules(author, NAME_RULES_INSPIRE)
     return author
 
 def get_recid(input_id):
@@ -201,159 +624,215 @@ def get_recid(input_id):
             return None
     return recid
 
-#def create_xml(eprint=None, doi=None, author_dict=None):
-def create_xml(author_dict=None):
-    """Take in the author dictionary and write it out as xml."""
-
-    aff_counter = 0
-    new_aff_dict = {}
-    new_author_dict = {}
-
-    for key, value in author_dict.items():
-        author = value[0].split(',')
-        author.reverse()
-        author = " ".join(author)
-        if author in new_author_dict:
-            author = author + '2'
-        new_author_dict[author] = []
-        for aff in value[1]:
-            if aff not in new_aff_dict:
-                aff_counter += 1
-                new_aff_dict[aff] = aff_counter
-            new_author_dict[author].append(new_aff_dict[aff])
-        #print(author, new_author_dict[author], value[1])
-
-    for author, affkeys in new_author_dict.items():
-        print(author, ','.join(str(affkey) for affkey in affkeys))
-    print('\n')
-    for key, value in new_aff_dict.items():
-        key = re.sub(r'\s+', ' ', key)
-        print(value, LatexNodes2Text().latex_to_text(key))
-
-    #print(new_author_dict)
-    #print(new_aff_dict)
-
-    record = {}
-    #record_add_field(record, '001', controlfield_value=str(recid))
-    #tag = '100__'
-    #EMAIL_REGEX = re.compile(r"^[\w\-\.\'\+]+@[\w\-\.]+\.\w{2,4}$")
-    #ORCID_REGEX = re.compile(r'^0000-\d{4}-\d{4}-\d{3}[\dX]$')
-    #INSPIRE_REGEX = re.compile(r'^INSPIRE-\d{8}$')
-    for key in author_dict:
-        subfields = []
-        author = author_dict[key][0]
-        #print author_dict
-        match_obj = re.search(ORCID_REGEX, author)
-        if match_obj:
-            orcid = match_obj.group(1)
-            if not re.match(ORCID_REGEX, orcid):
-                print('1 Problem with', orcid)
-            if ('j', 'ORCID:' + orcid) not in subfields:
-                subfields.append(('j', 'ORCID:' + orcid))
-            author = author.replace(orcid, '')
-            author = author.replace('[]', '')
-        match_obj = re.search(r'(INSPIRE-\d{8})', author)
-        if match_obj:
-            inspire = match_obj.group(1)
-            if not re.match(INSPIRE_REGEX, inspire):
-                print('Problem with', inspire)
-            subfields.append(('i', inspire))
-            author = author.replace(inspire, '')
-            author = author.replace('[]', '')
-        if u':' in author:
-            match_obj = re.match('(.*):(.*)', author, re.U)
-            author = match_obj.group(1)
-            subfields.append(('q', match_obj.group(2)))
-        subfields.append(('a', author))
-
-        for affiliation in author_dict[key][1]:
-            affiliation = re.sub(r'\\affinfn{(.*)}{(.*)}', r'INFN \1 \2',
-                                 affiliation)
-            affiliation = re.sub(r'\\affuni{(.*)}{(.*)}', r'\1 University \2',
-                                 affiliation)
-            #affiliation = translate_latex2unicode(affiliation)
-            affiliation = LatexNodes2Text().latex_to_text(affiliation)
-            #affiliation = re.sub(r'(\w)\W*$', r'\1', affiliation)
-            affiliation = re.sub(r'([\.\,]+)', r'\1 ', affiliation)
-            affiliation = re.sub(r'\s+', ' ', affiliation)
-            affiliation = re.sub(r'\s$', r'', affiliation)
-            affiliation = re.sub(r'\s*also at[\:\s]*', r'',
-                                 affiliation, re.IGNORECASE)
-            affiliation = re.sub(r'\s*\\and$', r'', affiliation)
-
-            if False and r"@" in affiliation and r"0000-" in affiliation:
-                affiliation = affiliation.replace(';', ' ')
-                affiliation = affiliation.replace(r'. ', r'.')
-                email = re.search(r"(\S+\@\S+)", affiliation).group(1)
-                orcid = re.search(r"(0000-\S+)", affiliation).group(1)
-                if re.match(EMAIL_REGEX, email):
-                    subfields.append(('m', 'email:' + email))
-                else:
-                    print('Email problem:', email)
-                if re.match(ORCID_REGEX, orcid) and \
-                   ('j', 'ORCID:' + orcid) not in subfields:
-                    subfields.append(('j', 'ORCID:' + orcid))
-                else:
-                    print('ORCID problem:', orcid)
-                continue
-            if False and r"@" in affiliation:
-                affiliation = affiliation.replace(r'. ', r'.')
-                subfields.append(('m', affiliation))
+class AuthorList:
+    """
+    An author list held column by column. Row i of names,
+    alternative_names, ids and affiliation_indices is the i-th author;
+    the indices point into the affiliation columns, which hold each
+    distinct affiliation once.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.alternative_names = []
+        self.ids = []
+        self.affiliation_indices = []
+        #Printed name, e.g. John Smith, to its row
+        self.labels = {}
+        self.raw_affiliations = []
+        self.affiliation_positions = {}
+        self.affiliations = []
+        self.inspire_affiliations = []
+        self.affiliation_ids = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add_author(self, author, affiliations):
+        """Add an author in INSPIRE form and their raw affiliations."""
+
+        row = len(self.names)
+        label = author.split(',')
+        label.reverse()
+        label = ' '.join(label)
+        if label in self.labels:
+            label = label + '2'
+        self.labels[label] = row
+        indices = []
+        for affiliation in affiliations:
+            if affiliation not in self.affiliation_positions:
+                self.affiliation_positions[affiliation] = \
+                    len(self.raw_affiliations)
+                self.raw_affiliations.append(affiliation)
+            indices.append(self.affiliation_positions[affiliation])
+        self.affiliation_indices.append(indices)
+        ids = []
+        for match in AUTHOR_ID_REGEX.finditer(author):
+            ids.append((match.lastgroup, match.group(match.lastgroup)))
+            author = author.replace(match.group(0), '')
+        if ids:
+            author = author.replace('[]', '').strip()
+        alternative_name = None
+        if ':' in author:
+            author, alternative_name = author.rsplit(':', 1)
+        self.names.append(author)
+        self.alternative_names.append(alternative_name)
+        self.ids.append(ids)
+
+    def clean_affiliations(self):
+        """Clean each distinct affiliation once, setting aside author ids."""
+
+        for affiliation in self.raw_affiliations[len(self.affiliations):]:
+            match = AUTHOR_ID_REGEX.fullmatch(affiliation.strip())
+            if match:
+                self.affiliation_ids.append((match.lastgroup,
+                                             match.group(match.lastgroup)))
+                self.affiliations.append('')
+                self.inspire_affiliations.append('')
                 continue
-            #elif re.match(r"^0000-0", affiliation):
-            if False and re.search(r"0000-0", affiliation):
-                #print 'XXX', affiliation
-                for aff in affiliation.split():
-                    aff = re.sub(r'[^\d^\-^X]', '', aff)
-                    orcid = re.search(ORCID_REGEX, aff)
-                    if orcid:
-                        orcid = orcid.group(0)
-                        if ('j', 'ORCID:' + orcid) not in subfields:
-                            subfields.append(('j', 'ORCID:' + orcid))
-                        affiliation = re.sub(orcid, '', affiliation)
-                        affiliation = re.sub(r'\s+$', '', affiliation)
-
-                        #print 'YYY', affiliation
-
-
-                        #subfields.append(('v', affiliation))
-                        #break
-                if not orcid:
-                    print('ORCID problem:', affiliation)
-                #Removed this to process aff that contained ORCID
-                #continue
-            elif re.match(r"^INSPIRE-", affiliation):
-                subfields.append(('i', affiliation))
-                #Removed this to process aff that contained ORCID
-                #continue
-
-            affiliation = affiliation.replace('[]', '')
+            self.affiliation_ids.append(None)
+            affiliation = apply_rules(affiliation, AFFILIATION_RULES_LATEX)
+            affiliation = latex_to_text(affiliation)
+            affiliation = apply_rules(affiliation, AFFILIATION_RULES_TEXT)
+            self.affiliations.append(affiliation)
             if not affiliation:
+                self.inspire_affiliations.append('')
                 continue
-            affiliation_key = re.sub(r'\W+', ' ', affiliation).upper()
-            affiliation_key = re.sub(r'\s*(.+\S)\s*', r'\1', affiliation_key)
-            try:
-                for inst in AFFILIATIONS_DONE[affiliation_key]:
-                    inst = re.sub(r'^\s+', '', inst)
-                    if inst:
-                        subfields.append(('u', inst))
-            except KeyError:
+            affiliation_key = \
+                AFFILIATION_KEY_REGEX.sub(' ', affiliation).upper().strip()
+            inspire_affiliation = get_cached_affiliation(affiliation_key)
+            if inspire_affiliation is None:
                 #inspire_affiliation = get_aff(unidecode(affiliation))
                 inspire_affiliation = unidecode(affiliation)
-                for inst in inspire_affiliation:
-                    inst = re.sub(r'^\s+', '', inst)
-                    if inst:
-                        subfields.append(('u', inst))
                 if not TEST:
-                    AFFILIATIONS_DONE[affiliation_key] = inspire_affiliation
-            if affiliation:
-                subfields.append(('v', affiliation))
-        #record_add_field(record, tag[0:3], tag[3], tag[4], \
-        #                 subfields=subfields)
-        #tag = '700__'
-    #return print_rec(record)
-    #print(record)
-    return record
+                    store_affiliation(affiliation_key, inspire_affiliation)
+            self.inspire_affiliations.append(inspire_affiliation.strip())
+
+    def get_ids(self, row):
+        """The ids of an author, from the name and the affiliations."""
+
+        ids = list(self.ids[row])
+        for index in self.affiliation_indices[row]:
+            author_id = self.affiliation_ids[index]
+            if author_id and author_id not in ids:
+                ids.append(author_id)
+        return ids
+
+    def get_affiliations(self, row):
+        """The (cleaned, INSPIRE) affiliations of an author."""
+
+        affiliations = []
+        for index in self.affiliation_indices[row]:
+            if self.affiliations[index]:
+                affiliations.append((self.affiliations[index],
+                                     self.inspire_affiliations[index]))
+        return affiliations
+
+    def print_list(self):
+        """Print the authors with affiliation numbers, then the numbers."""
+
+        for label, row in self.labels.items():
+            print(label, ','.join(str(index + 1) for index in
+                                  self.affiliation_indices[row]))
+        print('\n')
+        for index, affiliation in enumerate(self.raw_affiliations):
+            print(index + 1,
+                  latex_to_text(WHITESPACE_REGEX.sub(' ', affiliation)))
+
+def create_xml(author_dict=None):
+    """Take in the author dictionary and build the author list."""
+
+    author_list = AuthorList()
+    for value in author_dict.values():
+        author_list.add_author(value[0], value[1])
+    author_list.print_list()
+    author_list.clean_affiliations()
+    return author_list
+
+def author_to_json(author_list, row):
+    """An author in INSPIRE JSON form."""
+
+    author = {'full_name':author_list.names[row]}
+    if author_list.alternative_names[row]:
+        author['alternative_names'] = [author_list.alternative_names[row]]
+    ids = []
+    emails = []
+    for id_type, value in author_list.get_ids(row):
+        if id_type == 'EMAIL':
+            emails.append(value)
+        else:
+            ids.append({'schema':INSPIRE_ID_SCHEMAS[id_type], 'value':value})
+    if ids:
+        author['ids'] = ids
+    if emails:
+        author['emails'] = emails
+    affiliations = author_list.get_affiliations(row)
+    if affiliations:
+        inspire_affiliations = []
+        for _, inspire_affiliation in affiliations:
+            if inspire_affiliation not in inspire_affiliations:
+                inspire_affiliations.append(inspire_affiliation)
+        author['affiliations'] = [{'value':value}
+                                  for value in inspire_affiliations]
+        author['raw_affiliations'] = [{'value':value}
+                                      for value, _ in affiliations]
+    return author
+
+def write_json(author_list, output, recid=None):
+    """
+    Write the author list as an INSPIRE JSON record,
+    one author at a time.
+    """
+
+    output.write('{')
+    if recid:
+        output.write('"control_number": ' + json.dumps(int(recid)) + ', ')
+    output.write('"authors": [')
+    for row in range(len(author_list)):
+        if row:
+            output.write(',')
+        output.write('\n  ')
+        output.write(json.dumps(author_to_json(author_list, row),
+                                ensure_ascii=False))
+    output.write('\n]}\n')
+
+def author_to_marc(author_list, row):
+    """The (code, value) subfields of an author."""
+
+    subfields = [('a', author_list.names[row])]
+    if author_list.alternative_names[row]:
+        subfields.append(('q', author_list.alternative_names[row]))
+    for id_type, value in author_list.get_ids(row):
+        subfields.append((MARC_ID_SUBFIELDS[id_type][0],
+                          MARC_ID_SUBFIELDS[id_type][1] + value))
+    affiliations = author_list.get_affiliations(row)
+    for _, inspire_affiliation in affiliations:
+        if ('u', inspire_affiliation) not in subfields:
+            subfields.append(('u', inspire_affiliation))
+    for affiliation, _ in affiliations:
+        subfields.append(('v', affiliation))
+    return subfields
+
+def write_marcxml(author_list, output, recid=None):
+    """
+    Write the author list as a MARCXML record, one author at a time.
+    The first author is a 100 field, the rest 700.
+    """
+
+    output.write('<collection>\n<record>\n')
+    if recid:
+        output.write(f'  <controlfield tag="001">{recid}</controlfield>\n')
+    for row in range(len(author_list)):
+        tag = '700' if row else '100'
+        lines = [f'  <datafield tag="{tag}" ind1=" " ind2=" ">']
+        for code, value in author_to_marc(author_list, row):
+            lines.append(f'    <subfield code="{code}">{escape(value)}'
+                         '</subfield>')
+        lines.append('  </datafield>\n')
+        output.write('\n'.join(lines))
+    output.write('</record>\n</collection>\n')
+
+SERIALIZERS = {'json':write_json, 'xml':write_marcxml}
 
 
 def preprocess_file_braces(read_data):
@@ -371,6 +850,50 @@ def preprocess_file_braces(read_data):
     #print repr(read_data)
     return read_data
 
+class LineDocument:
+    """
+    A document held as a list of lines, indexed by their text, so that
+    replacing a whole line costs the number of copies of that line
+    rather than a pass over the whole document.
+    """
+
+    def __init__(self, read_data):
+        self.lines = read_data.split('\n')
+        self.positions = {}
+        for position, line in enumerate(self.lines):
+            self.positions.setdefault(line, []).append(position)
+
+    def replace(self, line, line_new, count=-1):
+        """read_data.replace(line, line_new, count) for whole lines."""
+
+        if line == line_new or line not in self.positions:
+            return
+        positions = self.positions.pop(line)
+        if 0 < count < len(positions):
+            positions.sort()
+            self.positions[line] = positions[count:]
+            positions = positions[:count]
+        for position in positions:
+            self.lines[position] = line_new
+        self.positions.setdefault(line_new, []).extend(positions)
+
+    def replace_text(self, old, new):
+        """read_data.replace(old, new) within every line."""
+
+        for position, line in enumerate(self.lines):
+            if old in line:
+                self.positions[line].remove(position)
+                if not self.positions[line]:
+                    del self.positions[line]
+                self.lines[position] = line.replace(old, new)
+                self.positions.setdefault(self.lines[position],
+                                          []).append(position)
+
+    def text(self):
+        """The document as a string."""
+
+        return '\n'.join(self.lines)
+
 def preprocess_file(read_data):
     """Get file into a form that can be properly processed."""
 
@@ -380,13 +903,13 @@ def preprocess_file(read_data):
     command_dict = {}
     for line in read_data.split('\n'):
         match = None
-        if re.search('command', line):
-            match = re.search(r'\\r?e?newcommand\*?\{\\(\w+)\}\{(.*)\}', line)
-        elif re.search(r'\\def\\', line):
-            match = re.search(r'\\def\\(\w+)\{(.*)\}', line)
+        if 'command' in line:
+            match = NEWCOMMAND_REGEX.search(line)
+        elif '\\def\\' in line:
+            match = DEF_REGEX.search(line)
         if match:
             command_value = match.group(2)
-            if re.search(r'^\\\w', command_value):
+            if COMMAND_VALUE_REGEX.search(command_value):
                 command_value = '\\' + command_value
             command_dict[match.group(1)] = command_value
     for key in command_dict:
@@ -399,136 +922,103 @@ def preprocess_file(read_data):
 
     read_data = read_data.replace('{+}', '{WXYZ}')
 
-    for line in read_data.split('\n'):
-    #    #\href{http://inspirehep.net/record/1068305}{J.~Alimena}$^{7}$
-    #    match_obj = re.search(r'/record/(\d+).*$', line)
-    #    if match_obj:
-    #        for id_type in ['ORCID', 'INSPIRE']:
-    #            id_num = get_hepnames_anyid_from_recid(match_obj.group(1),
-    #                                                   id_type)
-    #            if id_num:
-    #                #print line
-    #                line_new = re.sub(r'.*\}\{(.*)\}(\$\^.*)',
-    #                                  r'\1 [' + id_num + r']\2', line)
-    #                read_data = read_data.replace(line, line_new)
-    #                #print line_new
-    #                continue
-    #    match_obj = re.search(r'record/(\d+)', line)
-    #    if match_obj:
-    #        try:
-    #            inst = get_fieldvalues(match_obj.group(1), '110__u')[0]
-    #            line_new = re.sub(r'\\href{http://inspirehep.net/record/\d+}',
-    #                       inst + ' %', line)
-    #            print(line_new)
-    #            read_data = read_data.replace(line, line_new)
-    #        except IndexError:
-    #            pass
-
+    document = LineDocument(read_data)
+    line_new = None
+    external_institutes = False
+    for line in list(document.lines):
         #John Smith (University of Somewhere)
-        if re.search(r'^[A-Z].* \(.*\)\s*$', line):
-            line_new = re.sub(r'(.*)\s+\((.*)\)',
-                              r'\\author{\1}\n\\affiliation{\2}', line)
-            read_data = read_data.replace(line, line_new)
+        if AUTHOR_PARENTHESES_REGEX.search(line):
+            line_new = AUTHOR_PARENTHESES_SUB_REGEX.sub(
+                r'\\author{\1}\n\\affiliation{\2}', line)
+            document.replace(line, line_new)
 
         #Josh~McFayden\affmark[1,3]
-        if re.search(r'\\affmark\[', line):
-            line_new = re.sub(r'\\affmark\[(.*)\]', r'$^{\1}$', line)
-            read_data = read_data.replace(line, line_new)
+        if '\\affmark[' in line:
+            line_new = AFFMARK_REGEX.sub(r'$^{\1}$', line)
+            document.replace(line, line_new)
 
         #\AddAuthor{C.~Lindsey}{11}{}{}
-        if re.search(r'\\AddAuthor{', line):
-            line_new = \
-                     re.sub(r'\\AddAuthor{(.*)}{([^\}]*)}{([^\}]*)}{([^\}]*)}',
-                              r'\1$^{\2,\3,\4}$', line)
+        if '\\AddAuthor{' in line:
+            line_new = ADD_AUTHOR_REGEX.sub(r'\1$^{\2,\3,\4}$', line)
             line_new = re.sub('[,]+}', '}', line_new)
             line_new = re.sub('{[,]+', '{', line_new)
             line_new = line_new.replace(',,', ',')
-            read_data = read_data.replace(line, line_new)
+            document.replace(line, line_new)
         #\AddInstitute{1a}{Blah blah} \AddExternalInstitute
         line = line.replace('\\AddExternalInstitute', '\\AddInstitute')
-        if re.search(r'\\AddInstitute{([^\}]+)}{', line):
-            line_new = re.sub(r'\\AddInstitute{([^\}]+)}', r'$^{\1}$ ', line)
-            read_data = read_data.replace('\\AddExternalInstitute', '\\AddInstitute')
-            read_data = read_data.replace(line, line_new)
+        if ADD_INSTITUTE_REGEX.search(line):
+            line_new = ADD_INSTITUTE_SUB_REGEX.sub(r'$^{\1}$ ', line)
+            if not external_institutes:
+                document.replace_text('\\AddExternalInstitute',
+                                      '\\AddInstitute')
+                external_institutes = True
+            document.replace(line, line_new)
 
         #\firstname{C.-H.} \lastname{Yu} \inst{4}
-        if re.search(r'\\firstname{', line) and re.search(r'\\inst{', line):
-            line_new = re.sub(r'\\firstname{(.*)}\s*\\lastname{(.*)}\s*\\inst(\{.*\}).*',
-                      r'YYYY\2, \1$^\3$', line)
-            read_data = read_data.replace(line, line_new)
+        if '\\firstname{' in line and '\\inst{' in line:
+            line_new = FIRSTNAME_INST_REGEX.sub(r'YYYY\2, \1$^\3$', line)
+            document.replace(line, line_new)
         #\firstname{C.-H.} \lastname{Yu}
-        elif re.search(r'\\firstname{', line):
-            #line_new = re.sub(r'\\firstname{([^\}]+)}\s*\\lastname{([^\}]+)}',
-            line_new = re.sub(r'\\firstname{(.*)}\s*\\lastname{(.*)}',
-                      r'YYYY\2, \1', line)
-            read_data = read_data.replace(line, line_new)
+        elif '\\firstname{' in line:
+            line_new = FIRSTNAME_REGEX.sub(r'YYYY\2, \1', line)
+            document.replace(line, line_new)
         #I.J.~Arnquist\inst{10}
-        if re.search(r'\\inst\{', line):
-            line_new = re.sub(r'\\inst({[^\}]+\})', r'$^\1$', line)
-            read_data = read_data.replace(line, line_new)
+        if '\\inst{' in line:
+            line_new = INST_REGEX.sub(r'$^\1$', line)
+            document.replace(line, line_new)
     #print "read_data =", read_data
 
     #Special treatment for BaBar
-    for line in read_data.split('\n'):
+    document = LineDocument(document.text())
+    for line in list(document.lines):
         #BaBar \affiliation{Fermilab$^{a}$, SLAC$^{b}$}
-        if re.search(r'\\affiliation\{.*\$\^\{?[abc]\}?\$', line):
-            line_new = re.sub(r'\$\^\{?[abc]\}?\$', ' and ', line)
-            read_data = read_data.replace(line, line_new)
-        elif re.search(r'\\author\{.*\$\^\{?[abc]+\}?\$', line):
-            line_new = re.sub(r'[ ]*\$\^\{?[abc]+\}?\$[ ]*', '', line)
-            read_data = read_data.replace(line, line_new)
-        elif re.search(r'\\author\{.*\\altaffiliation', line):
-            line_new = re.sub(r'\\altaffiliation.*', '', line)
-            read_data = read_data.replace(line, line_new)
-        if VERBOSE:
-            try:
-                print('BABAR LINE =', line_new)
-            except UnboundLocalError:
-                pass
+        if BABAR_AFFILIATION_REGEX.search(line):
+            line_new = BABAR_MARK_REGEX.sub(' and ', line)
+            document.replace(line, line_new)
+        elif BABAR_AUTHOR_REGEX.search(line):
+            line_new = BABAR_AUTHOR_MARK_REGEX.sub('', line)
+            document.replace(line, line_new)
+        elif BABAR_ALTAFFILIATION_REGEX.search(line):
+            line_new = ALTAFFILIATION_REGEX.sub('', line)
+            document.replace(line, line_new)
+        if VERBOSE and line_new is not None:
+            print('BABAR LINE =', line_new)
 
     #Special treatment for DES and Fermi-LAT and Planck
     astro_aff_counter = 0
-    for line in read_data.split('\n'):
+    for line in list(document.lines):
         #Get rid of newcommand lines now
-        if re.search('newcommand', line):
-            read_data = read_data.replace(line, '')
+        if 'newcommand' in line:
+            document.replace(line, '')
         if VERBOSE:
             print('ASTRO LINE =', line)
-        if re.search(r'\\section\*\{Affiliations\}', line) or \
-           re.search(r'\\institute\{\\small', line):
+        if '\\section*{Affiliations}' in line or \
+           '\\institute{\\small' in line:
             astro_aff_counter = 1
-        if astro_aff_counter and re.search(r'^\\item', line):
-            line_new = \
-                re.sub(r'^\\item', r'$^{' + str(astro_aff_counter) + r'}$', \
-                line)
-            read_data = read_data.replace(line, line_new, 1)
+        if astro_aff_counter and line.startswith('\\item'):
+            line_new = ASTRO_ITEM_REGEX.sub(
+                r'$^{' + str(astro_aff_counter) + r'}$', line)
+            document.replace(line, line_new, 1)
             astro_aff_counter += 1
-        elif astro_aff_counter and re.search(r'\\goodbreak[ ]*$', line):
-            line_new = \
-                re.sub(r'(.*)[ ]*\\goodbreak[ ]*$', r'$^{' + \
-                       str(astro_aff_counter) + r'}$ \1', \
-                       line)
-            read_data = read_data.replace(line, line_new, 1)
+        elif astro_aff_counter and ASTRO_GOODBREAK_REGEX.search(line):
+            line_new = ASTRO_GOODBREAK_REGEX.sub(
+                r'$^{' + str(astro_aff_counter) + r'}$ \1', line)
+            document.replace(line, line_new, 1)
             if VERBOSE:
                 print(astro_aff_counter, line)
                 print(line_new)
             astro_aff_counter += 1
-        elif astro_aff_counter and re.search(r'.\\and[ ]*$', line):
-            line_new = \
-                re.sub(r'(.*)[ ]*\\and[ ]*$', r'$^{' + \
-                       str(astro_aff_counter) + r'}$ \1', \
-                       line)
-            read_data = read_data.replace(line, line_new, 1)
+        elif astro_aff_counter and ASTRO_AND_REGEX.search(line):
+            line_new = ASTRO_AND_SUB_REGEX.sub(
+                r'$^{' + str(astro_aff_counter) + r'}$ \1', line)
+            document.replace(line, line_new, 1)
             astro_aff_counter += 1
     #print read_data
 
 
     #Special treatment for LIGO and Virgo
-    pattern_au = re.compile(r"^([A-Z])[\~\.]([^-]*)([A-Z])([^A-Z]+)\s*\%\s*"
-                         r"([a-z])([a-z]+)\.([a-z])([a-z]+)")
-    pattern_af = re.compile(r"\\affiliation\s*\{(.*)\}\s*\%.*(\{\d+\})")
-    for line in read_data.split('\n'):
-        match = re.match(pattern_au, line)
+    for line in list(document.lines):
+        match = LIGO_AUTHOR_REGEX.match(line)
         if match:
             if match.group(5).upper() == match.group(1) and \
                match.group(7).upper() == match.group(3):
@@ -536,135 +1026,114 @@ def preprocess_file(read_data):
                            match.group(2) + ' ' + match.group(3) + \
                            match.group(4)
                 #print line_new, '\t\t', line
-                read_data = read_data.replace(line, line_new)
-        match = re.match(pattern_af, line)
+                document.replace(line, line_new)
+        match = LIGO_AFFILIATION_REGEX.match(line)
         if match:
             line_new = "$^" + match.group(2) + "$" + match.group(1)
             #print line_new
-            read_data = read_data.replace(line, line_new)
+            document.replace(line, line_new)
+    read_data = document.text()
 
-    #Remove spaces around braces and commas
-    read_data = re.sub(r'[ ]*([\]\}\[\{\,])[ ]*', r'\1', read_data)
-    read_data = re.sub(r'^[ ]+', '', read_data)
-
-    read_data = re.sub(r'\-+', r'-', read_data)
-
-    read_data = re.sub(r'%.*\n', '\n', read_data)
-    read_data = re.sub(r'}\$,\s*', '}$\n', read_data)
-    read_data = re.sub(r'\$\^(\w)\$,\s*', r'$^\1$\n', read_data)
-    read_data = re.sub(r'\\thanks\{[^\}]+(0000-0[\d\-]+[\dX])[^\}]*\}',
-                r'\\affiliation{\1}', read_data)
-    read_data = re.sub(r'\}?\\thanks\{[^\}]+\}?', r'', read_data)
-    read_data = re.sub(r'\\item\[(\$\^\{?\w+\}?\$)\]', r'\1', read_data)
-    read_data = re.sub(r'\\llap\{(\$\S+\$)\}', r'\1 ', read_data)
-    read_data = re.sub(r'\\textsuperscript\{([a-z\d\,]+)\}\{',
-                       r'$^{\1$} \{', read_data)
-    read_data = re.sub(r'\\textsuperscript\{([a-z\d\,]+)\}',
-                       r'$^{\1$}\n', read_data)
-    read_data = re.sub(r'\\address', r'\\affiliation', read_data)
-    read_data = re.sub(r'\\affil\b', r'\\affiliation', read_data)
-    read_data = re.sub(r'\\email\{', r'\\affiliation{', read_data)
-    read_data = re.sub(r'}\s*\\affiliation', '}\n\\\\affiliation', read_data)
-    read_data = re.sub(r'}\s*\\author', '}\n\\\\author', read_data)
-    read_data = re.sub(r'[ ]*\\scriptsize[ ]+', '', read_data)
-    read_data = re.sub(r'\\and[ ]+', '', read_data)
-    read_data = re.sub(r'\$\s*\^', '$^', read_data)
+    for pattern, replacement in PREPROCESS_CLEANUP:
+        read_data = pattern.sub(replacement, read_data)
     if VERBOSE:
         print('read_data =', read_data)
-    read_data = re.sub(r'Irefn{(\w+)}\\Aref{(\w+)}\\Aref{(\w+)}', \
-                       r'Irefn{\1,\2,\3}', read_data)
-    read_data = re.sub(r'Irefn+\{(.*)\}\\?A?r?e?f?s?\{(.*)\}', \
-                       r'Irefn{\1,\2}', read_data)
-    read_data = re.sub(r'Arefs?{(\w+)}', r'Irefn{\1}', read_data)
-    read_data = re.sub(r'\\Idef{(\w+)}', r'$^{\1}$', read_data)
-    #read_data = \
-    #    re.sub(r'(\w\.?)[ \,]*\\(inst|altaffilmark|Irefn)\{(.*)\}', \
-    #           r'\1$^{\3}$', read_data)
-    read_data = \
-        re.sub(r'[ \,]*\\(inst|altaffilmark|Irefn|thanksref)\{([^\}]+)\}', \
-               r'$^{\2}$', read_data)
-    #\altaffiltext{2}{Fermilab, Batavia}
-    read_data = \
-        re.sub(r'\\(altaffiltext|thankstext)\{([\w\,\-]+)\}\{(.*)\}', \
-               r'$^{\2}$ \3', read_data)
-    read_data = \
-        re.sub(r'\\item\s*\\[IA]def\{([\w\,\-]+)\}\{(.*)\}', r'$^{\1}$ \2', \
-               read_data)
-    read_data = \
-        re.sub(r'\\[IA]def\{([\w\,\-]+)\}\{(.*)\}', r'$^{\1}$ \2', \
-               read_data)
-    read_data = \
-        re.sub(r'(.*)\s*\\label\{(.*)\}', r'$^{\2}$ \1', \
-               read_data)
-    #\author[b,c]{M. Zimmermann} \affiliation[b]{Fermilab}
-    read_data = \
-        re.sub(r'\\author\[([\w\,\-]+)\]\{(.*)\}', r'\2$^{\1}$', read_data)
-    read_data = \
-        re.sub(r'\\affiliation\[([\w\,\-]+)\]\{(.*)\}', r'$^{\1}$ \2', \
-               read_data)
-    #\author{M. Zimmermann$^{b,c}$} \affiliation{$^{b}$Fermilab} remove \author
-    read_data = \
-        re.sub(r'\\author\{(.*\$\^\{?[\w\,\-]+\}?\$)\}', r'\1', read_data)
-    read_data = \
-        re.sub(r'\\affiliation\{(\$\^\{?[\w\,\-]+\}?\$.*)\}', r'\1', read_data)
-
-    read_data = re.sub(r'[\, ]+\}', '}', read_data)
-    read_data = re.sub(r'[\, ]+\$\^', '$^', read_data)
+    for pattern, replacement in PREPROCESS_REFERENCES:
+        read_data = pattern.sub(replacement, read_data)
     #print read_data
     new_read_data = []
     for line in read_data.split('\n'):
-        if re.search('abstract', line, re.IGNORECASE) and astro_aff_counter < 1:
+        if ABSTRACT_REGEX.search(line) and astro_aff_counter < 1:
             break
         new_read_data.append(line)
     if VERBOSE:
         print('new_read_data =', new_read_data)
     return new_read_data
 
+def get_ieee_url(eprint):
+    """The page of an IEEE paper, from its DOI or url."""
+
+    if 'ieee' in eprint:
+        return eprint
+    return IEEE_DOI_URL + eprint
+
+def get_ieee_metadata(url):
+    """The document metadata embedded in an IEEE page, or None."""
+
+    if url in IEEE_METADATA:
+        return IEEE_METADATA[url]
+    try:
+        response = IEEE_SESSION.get(url, timeout=IEEE_TIMEOUT)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as err:
+        print('Problem with', url, err)
+        return None
+    match = IEEE_METADATA_REGEX.search(response.text)
+    if not match:
+        print('No IEEE metadata found', url)
+        return None
+    try:
+        metadata = json.loads(match.group(1))
+    except ValueError as err:
+        print('Problem with the IEEE metadata', url, err)
+        return None
+    IEEE_METADATA[url] = metadata
+    return metadata
+
+def fetch_ieee_metadata(urls, workers=IEEE_WORKERS):
+    """Fetch the metadata of many IEEE pages at the same time."""
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(get_ieee_metadata, urls):
+            pass
+
 def process_ieee(eprint):
     """Obtains authors and affiliations from ieee link
     """
-    request = requests.get(eprint)
-    uncleanjson = [line for line in request.text.split('\n') if
-        line.lstrip().startswith('global.document.metadata=')][0]
-    cleanjsonmatch = re.search(r'metadata\=(\{.*?\});$', uncleanjson)
-    if cleanjsonmatch:
-        cleanjson = cleanjsonmatch.group(1)
-        json_acceptable_string = cleanjson.replace('"', '\"')
-        json_dict = json.loads(json_acceptable_string)
-        cleanauths = {}
-        try:
-            auths = json_dict['authors']
-        except KeyError:
-            print('No IEEE authors found')
-            return None
-        for auth in auths:
-            auth['affiliation'] = re.sub(r'^\s+', '', auth['affiliation'])
-            if 'e-mail' in auth['affiliation']:
-                match_obj = re.match(r'(.*) \(e\-mail: (.*)\)',
-                            auth['affiliation'])
-                auth['affiliation'] = match_obj.group(1)
-                auth['email']       = match_obj.group(2)
-            cleanauths[auths.index(auth)+1] = \
-                [process_author_name(auth['name']), [auth['affiliation']]]
-            for id_type in ('orcid', 'email'):
-                if id_type in auth:
-                    cleanauths[auths.index(auth)+1][1].append(auth[id_type])
-        #try:
-        #    doi = json_dict['doi']
-        #except KeyError:
-        #    print('No doi found')
+
+    json_dict = get_ieee_metadata(eprint)
+    if json_dict is None:
+        return None
+    try:
+        auths = json_dict['authors']
+    except KeyError:
+        print('No IEEE authors found')
+        return None
+    cleanauths = {}
+    for position, auth in enumerate(auths, 1):
+        affiliations = auth.get('affiliation') or []
+        if isinstance(affiliations, str):
+            affiliations = [affiliations]
+        author_affiliations = []
+        emails = []
+        for affiliation in affiliations:
+            affiliation = affiliation.lstrip()
+            if 'e-mail' in affiliation:
+                match_obj = IEEE_EMAIL_REGEX.match(affiliation)
+                if match_obj:
+                    affiliation = match_obj.group(1)
+                    emails.append(match_obj.group(2))
+            author_affiliations.append(affiliation)
+        if 'orcid' in auth:
+            author_affiliations.append(auth['orcid'])
+        if 'email' in auth:
+            emails.append(auth['email'])
+        cleanauths[position] = [process_author_name(auth['name']),
+                                author_affiliations + emails]
 
     print('Number of authors:', len(cleanauths))
     return create_xml(author_dict=cleanauths)
 
-def process_file(eprint, file_type='tex'):
-    """Obtain authors and affiliations from file.
+def process_file(eprint, file_type='tex', read_data=None):
+    """Obtain authors and affiliations from file, or from its text.
        Creates a dictionary, author_dict, of the form
        {position:[author name, [list of affiliations]]
     """
 
-    with open(eprint.replace('/', '-') + '.' + file_type, 'r') as input_file:
-        read_data = input_file.read()
+    if read_data is None:
+        with open(eprint.replace('/', '-') + '.' + file_type,
+                  'r') as input_file:
+            read_data = input_file.read()
     read_data = preprocess_file(read_data)
     author_position = 0
     author_dict = {}
@@ -744,13 +1213,14 @@ def process_file(eprint, file_type='tex'):
 
     return create_xml(author_dict=author_dict)
 
-def main(eprint):
-    """Get the author list."""
-    filename = 'tmp_' + __file__
+def main(eprint, batch=False):
+    """Get the author list; returns the file it was written to, if any."""
+    filename = 'tmp_' + os.path.basename(__file__)
 
     eprint_tex = eprint.replace('/', '-') + ".tex"
     eprint_xml = eprint.replace('/', '-') + ".xml"
     file_type = None
+    read_data = None
     if VERBOSE:
         print('eprint =', eprint)
     if os.path.exists(eprint_tex) or os.path.exists(eprint_xml):
@@ -760,6 +1230,9 @@ def main(eprint):
         file_type = '1'
     elif eprint.startswith('10.1109'):
         file_type = '2'
+    elif batch:
+        print('Unknown paper type', eprint)
+        return
     else:
         file_type = input("""Choose paper type:
 1 arXiv
@@ -770,7 +1243,8 @@ def main(eprint):
             print('file_type', file_type)
         if file_type == '1':
             file_type = 'tex'
-            if not download_source(eprint):
+            read_data = download_source(eprint, BIB, DAT, batch)
+            if not read_data:
                 return
         elif file_type == '2':
             file_type = 'ieee'
@@ -781,7 +1255,7 @@ def main(eprint):
                 filename = re.sub('.py', '_' +
                       eprint.replace('/', '-').replace('.', '-') + \
                       '_correct.out', filename)
-                eprint = 'http://dx.doi.org/'+ eprint
+                eprint = get_ieee_url(eprint)
         else:
             print('Invalid choice')
             sys.exit()
@@ -791,37 +1265,112 @@ def main(eprint):
     if '_correct.out' not in filename:
         filename = re.sub('.py', '_' + eprint.replace('/', '-') + \
                       '_correct.out', filename)
-    output = open(filename,'w')
-    output.write('<collection>')
+    if OUTPUT_FORMAT == 'json':
+        filename = filename.replace('_correct.out', '_correct.json')
+    author_list = None
     if file_type == 'tex':
-        update = process_file(eprint)
+        author_list = process_file(eprint, read_data=read_data)
     elif file_type == 'ieee':
-        update = process_ieee(eprint)
-    if update:
-        output.write(update)
-    output.write('</collection>')
-    output.close()
-    #print(filename)
-    os.unlink(filename)
-
-    filename = __file__
-    filename = filename.replace('.py', '.log')
-    log = open(filename, 'a')
+        author_list = process_ieee(eprint)
+    close_affiliation_cache()
+    #Offline there is no INSPIRE to ask; without a recid the author
+    #list is written without control_number or 001.
+    recid = None
+    if SOURCE_MIRROR is None:
+        try:
+            recid = get_recid(eprint)
+        except requests.exceptions.RequestException as err:
+            print('Cannot look up the INSPIRE record of', eprint, err)
+    if author_list:
+        with open(filename, 'w', encoding='utf-8') as output:
+            SERIALIZERS[OUTPUT_FORMAT](author_list, output, recid)
+
+    log_filename = __file__
+    log_filename = log_filename.replace('.py', '.log')
+    log = open(log_filename, 'a')
     date_time_stamp = time.strftime('%Y-%m-%d %H:%M:%S')
     date_time_stamp = date_time_stamp + ' ' + eprint + '\n'
     log.write(date_time_stamp)
     log.close()
-    recid = get_recid(eprint)
     print('\n')
-    print(filename)
-    print('https://inspirehep.net/literature/' + str(recid))
+    print(log_filename)
+    if author_list:
+        print(filename)
+    if recid:
+        print('https://inspirehep.net/literature/' + str(recid))
+    if author_list:
+        return filename
+    return None
+
+def set_options(bib, dat, test, verbose, source_mirror, output_format):
+    """Pass the command line options on to a batch worker."""
+
+    global BIB, DAT, TEST, VERBOSE, SOURCE_MIRROR, OUTPUT_FORMAT
+    BIB, DAT, TEST, VERBOSE = bib, dat, test, verbose
+    SOURCE_MIRROR = source_mirror
+    OUTPUT_FORMAT = output_format
+
+def process_paper(eprint):
+    """
+    Get the author list of one paper in batch mode,
+    writing everything it prints to a file of its own.
+    Returns that file and what went wrong, or None.
+    """
+
+    filename = re.sub('.py', '_' + eprint.replace('/', '-') + '.txt',
+                      'tmp_' + os.path.basename(__file__))
+    problem = None
+    with open(filename, 'w') as output, contextlib.redirect_stdout(output):
+        try:
+            if not main(eprint, batch=True):
+                problem = 'no author list written'
+        except SystemExit:
+            problem = 'stopped'
+        except Exception as err:
+            problem = f'{type(err).__name__}: {err}'
+            print('Problem with', eprint, err)
+    return filename, problem
+
+def main_batch(eprints, workers=BATCH_WORKERS):
+    """
+    Get the author lists of many papers with a pool of workers.
+    IEEE pages are fetched by a pool of threads first and their
+    author lists made here, while the workers get the arXiv ones.
+    """
+
+    ieee_eprints = set(eprint for eprint in eprints
+                       if eprint.startswith('10.1109'))
+    fetch_ieee_metadata([get_ieee_url(eprint) for eprint in ieee_eprints])
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=set_options,
+                             initargs=(BIB, DAT, TEST, VERBOSE,
+                                       SOURCE_MIRROR,
+                                       OUTPUT_FORMAT)) as executor:
+        futures = {eprint:executor.submit(process_paper, eprint)
+                   for eprint in eprints if eprint not in ieee_eprints}
+        failed = 0
+        for eprint in eprints:
+            if eprint in futures:
+                try:
+                    filename, problem = futures[eprint].result()
+                except Exception as err:
+                    filename, problem = None, f'{type(err).__name__}: {err}'
+            else:
+                filename, problem = process_paper(eprint)
+            if problem:
+                failed += 1
+                print(eprint, filename, 'FAILED:', problem)
+            else:
+                print(eprint, filename)
+    print(f'{len(eprints) - failed} of {len(eprints)} papers done, '
+          f'{failed} failed')
 
 if __name__ == '__main__':
 
-    BIB = DAT = TEST = VERBOSE = False
+    WORKERS = BATCH_WORKERS
 
     try:
-        OPTIONS, ARGUMENTS = getopt.gnu_getopt(sys.argv[1:], 'bdtv')
+        OPTIONS, ARGUMENTS = getopt.gnu_getopt(sys.argv[1:], 'bdtvf:l:o:w:')
     except getopt.error:
         print('Error: you tried to use an unknown option')
         sys.exit(0)
@@ -835,6 +1384,19 @@ if __name__ == '__main__':
             TEST = True
         if option == '-v':
             VERBOSE = True
+        if option == '-f':
+            if argument not in SERIALIZERS:
+                print('Error: the format is one of', ', '.join(SERIALIZERS))
+                sys.exit(0)
+            OUTPUT_FORMAT = argument
+        if option == '-l':
+            with open(argument, 'r') as eprint_list:
+                ARGUMENTS += [line.strip() for line in eprint_list
+                              if line.strip()]
+        if option == '-o':
+            SOURCE_MIRROR = argument
+        if option == '-w':
+            WORKERS = int(argument)
 
     if TEST:
         def get_aff(aff):
@@ -844,29 +1406,15 @@ if __name__ == '__main__':
         #from hep_aff import get_aff
         pass
 
-    if len(ARGUMENTS) != 1:
+    if not ARGUMENTS:
         print('You didn\'t specify an eprint number')
         sys.exit(0)
 
     try:
-        try:
-            EPRINT = ARGUMENTS[0]
-            #main(EPRINT)
-        except IndexError:
-            print('Bad input', EPRINT)
-            sys.exit()
-        main(EPRINT)
+        if len(ARGUMENTS) > 1:
+            main_batch(ARGUMENTS, WORKERS)
+        else:
+            main(ARGUMENTS[0])
 
     except KeyboardInterrupt:
         print('Exiting')
-
-
-
-    #else:
-    #    try:
-    #        EPRINT = ARGUMENTS[0]
-    #        main(EPRINT)
-    #    except IndexError:
-    #        print "Bad input", EPRINT
-    #    except KeyboardInterrupt:
-    #        print 'Exiting'
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+'''
+Input for the lit_collaboration_authors.py script.
+'''
+
+#Names whose surname cannot be guessed, written as in the author list
+AUTHOR_NAME_OVERRIDES = {
+    'Tatjana Agatonovic Jovin':'Agatonovic Jovin, Tatjana',
+    'Ivanka Bozovic Jelisavcic':'Bozovic Jelisavcic, Ivanka',
+    'Enrique Calvo Alamillo':'Calvo Alamillo, Enrique',
+    'Ziad El Bitar':'El Bitar, Ziad',
+    'Hector García Cabrera':'García Cabrera, Hector',
+    'Amir Noori Shirazi':'Noori Shirazi, Amir',
+    'Maria Soledad Robles Manzano':'Robles Manzano, Maria Soledad',
+    'Antonio Verdugo de Osa':'Verdugo de Osa, Antonio',
+}
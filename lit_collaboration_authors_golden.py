@@ -0,0 +1,66 @@
+#!/usr/bin/python
+'''
+Regression check of lit_collaboration_authors.preprocess_file.
+Each <name>.tex in GOLDEN_DIRECTORY is preprocessed and compared with
+the lines in <name>.out. With -u the .out files are written instead.
+'''
+
+import argparse
+import difflib
+import os
+import sys
+
+from lit_collaboration_authors import preprocess_file
+
+GOLDEN_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'lit_collaboration_authors_golden')
+
+def get_golden_files():
+    '''The names of the golden inputs, without the .tex.'''
+
+    return sorted(filename[:-4] for filename in os.listdir(GOLDEN_DIRECTORY)
+                  if filename.endswith('.tex'))
+
+def check_golden_file(name, update=False):
+    '''Preprocess one input; True if it gives the expected lines.'''
+
+    with open(os.path.join(GOLDEN_DIRECTORY, name + '.tex'), 'r') as tex:
+        lines = preprocess_file(tex.read())
+    expected_file = os.path.join(GOLDEN_DIRECTORY, name + '.out')
+    if update:
+        with open(expected_file, 'w') as expected:
+            expected.write('\n'.join(lines) + '\n')
+        return True
+    with open(expected_file, 'r') as expected:
+        expected_lines = expected.read()[:-1].split('\n')
+    if lines == expected_lines:
+        return True
+    print(f'{name}: preprocess_file differs from {name}.out')
+    for line in difflib.unified_diff(expected_lines, lines,
+                                     name + '.out', 'preprocess_file',
+                                     lineterm=''):
+        print(line)
+    return False
+
+def main(update=False):
+    '''Check every golden file, exiting non-zero if any differs.'''
+
+    failed = [name for name in get_golden_files()
+              if not check_golden_file(name, update)]
+    if update:
+        print('Updated', len(get_golden_files()), 'golden files')
+        return
+    print(f'{len(get_golden_files()) - len(failed)} golden files match, '
+          f'{len(failed)} differ')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--update',
+                        help='Write the current output as the golden files',
+                        action='store_true')
+    args = parser.parse_args()
+    main(args.update)
@@ -3,12 +3,15 @@
 import datetime
 import pickle
 import os
+import re
 
-from os.path import exists
+from os.path import exists, getmtime
 
 DIRECTORY = '/web/sites/ccd.fnal.gov/data/osti_accepteds/'
 OSTI_ACCEPTEDS_FILE = 'osti_accepteds_file.p'
 OSTI_ACCEPTEDS_FILE = DIRECTORY + OSTI_ACCEPTEDS_FILE
+OSTI_DOI_INDEX_FILE = DIRECTORY + 'osti_accepteds_doi_index.p'
+FERMILAB_REPORT_REGEX = re.compile(r'FERMILAB[\-\w]+')
 
 def check_in_accepteds(osti_id=None):
     '''Check to see if an osti_id is in the list of accepteds.'''
@@ -48,3 +51,53 @@ def store_accepteds(osti_accepteds):
     with open(OSTI_ACCEPTEDS_FILE, 'wb') as fname:
         pickle.dump(osti_accepteds, fname)
     print('Number of accepteds stored:', len(osti_accepteds))
+    store_doi_index(add_to_doi_index(load_doi_index(), osti_accepteds))
+
+def add_to_doi_index(doi_index, osti_accepteds):
+    '''Add the DOIs of accepteds that are not in the index yet.'''
+
+    for osti in osti_accepteds:
+        if osti in doi_index['osti_ids']:
+            continue
+        doi_index['osti_ids'].add(osti)
+        report = osti_accepteds[osti][1]
+        if report is None:
+            continue
+        if ';' in report:
+            report = FERMILAB_REPORT_REGEX.search(report).group()
+        for doi in osti_accepteds[osti][2]:
+            doi_index['dois'][doi.lower()] = report
+    return doi_index
+
+def load_doi_index():
+    '''Get the stored DOI index, or an empty one.'''
+
+    try:
+        with open(OSTI_DOI_INDEX_FILE, 'rb') as fname:
+            return pickle.load(fname)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return {'osti_ids':set(), 'dois':{}}
+
+def store_doi_index(doi_index):
+    '''Save the DOI index next to the accepteds.'''
+
+    try:
+        with open(OSTI_DOI_INDEX_FILE, 'wb') as fname:
+            pickle.dump(doi_index, fname)
+    except OSError as err:
+        print(f'Could not store the DOI index: {err}')
+
+def retrieve_doi_index():
+    '''
+    Get a dictionary of the Fermilab report of each accepted DOI.
+    The index is only brought up to date from the accepteds
+    when they have changed since it was stored.
+    '''
+
+    doi_index = load_doi_index()
+    if not exists(OSTI_DOI_INDEX_FILE) or \
+       getmtime(OSTI_ACCEPTEDS_FILE) > getmtime(OSTI_DOI_INDEX_FILE):
+        osti_accepteds = retrieve_accepteds()
+        if osti_accepteds:
+            store_doi_index(add_to_doi_index(doi_index, osti_accepteds))
+    return doi_index['dois']
@@ -4,12 +4,17 @@ Check that we have an accepted manuscript.
 All DOIs are lower-cased for the purpose of matching.
 '''
 
+import argparse
+import csv
+import json
 import logging
 import re
-from collections import Counter
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-from inspire_api import get_result, get_result_ids
-from osti_accepteds import retrieve_accepteds
+from inspire_api import get_result
+from osti_accepteds import retrieve_doi_index
+from osti_web_service import OstiRecordView
 from osti_fermilab_accepted_report_dois import DOIS
 
 DIVISIONS = ['A', '(AD|APC)', 'AE', 'CD', 'CMS', 'DI', 'E', 'LBNF', 'ND',
@@ -17,7 +22,26 @@ DIVISIONS = ['A', '(AD|APC)', 'AE', 'CD', 'CMS', 'DI', 'E', 'LBNF', 'ND',
 DIVISIONS = ['(AD|APC)', 'CD', 'CCD', 'DI', 'ESH', 'FESS', 'LBNF', 'ND',
              '(A|AE|CMS|E|PPD|T)', 'PIP2', 'QIS', 'SCD', 'TD', 'WDRS', 'V']
 
-JOURNALS = []
+def get_division_tokens():
+    '''Map each token after a '-' in a report number to its divisions.'''
+
+    division_tokens = {}
+    for division in DIVISIONS:
+        for token in division.strip('()').split('|'):
+            division_tokens.setdefault(token, []).append(division)
+    return division_tokens
+
+DIVISION_TOKENS = get_division_tokens()
+LABWIDE = 'No div.'
+REPORT_TOKEN_REGEX = re.compile(r'-(\w+)')
+REPORT_PARTS_REGEX = re.compile(r'^FERMILAB-([A-Z]+)-(\d+)(?:-(\d+))?')
+LABWIDE_REGEX = re.compile(r'.*-\d+$')
+ReportParts = namedtuple('ReportParts', 'year type serial divisions')
+
+#DOIs ORed into each search
+DOI_CHUNK_SIZE = 50
+DOI_FIELDS = ('control_number', 'dois', 'report_numbers')
+
 LOGFILE = __file__
 LOGFILE = re.sub(r'.*\/', 'tmp_', LOGFILE)
 LOGFILE = re.sub('.py', '.log', LOGFILE)
@@ -25,58 +49,58 @@ logging.basicConfig(filename=LOGFILE, filemode='w',
                     format='%(message)s',
                     level=logging.INFO)
 
+DOI_REPORT_DICT = None
+
 def get_doi_report_dict():
-    '''Create a dictionary keyed on the DOIs'''
-
-    doi_report_dict = {}
-    accepteds = retrieve_accepteds()
-    for osti in accepteds:
-        for doi in accepteds[osti][2]:
-            report = accepteds[osti][1]
-            if report is None:
-                continue
-            if ';' in report:
-                report = re.search(r'FERMILAB[\-\w]+', report).group()
-            doi_report_dict[doi.lower()] = report
-    return doi_report_dict
-
-DOI_REPORT_DICT = get_doi_report_dict()
+    '''The dictionary keyed on the DOIs, loaded on first use.'''
+
+    global DOI_REPORT_DICT
+    if DOI_REPORT_DICT is None:
+        DOI_REPORT_DICT = retrieve_doi_index()
+    return DOI_REPORT_DICT
+
+class FiscalYear:
+    '''
+    What checking the DOIs of one fiscal year found.
+    Log messages are kept so that years checked concurrently
+    can be written out in order.
+    '''
+
+    def __init__(self, year):
+        self.year = year
+        self.journals = Counter()
+        self.messages = [str(year)]
+        self.result = None
+
+    def info(self, message, *args):
+        '''Keep a log message for this year.'''
+
+        self.messages.append(message % args)
 
 def get_doi_prefix(doi):
     '''Use the DOI prefix as a proxy for journals'''
 
-    JOURNALS.append(re.sub(r'\/.*', '', doi))
+    return re.sub(r'\/.*', '', doi)
 
-def get_fermilab_report(recid):
-    '''Get the Fermilab report number.'''
-
-    accepted = False
-    fermilab_report = None
+def get_records_from_dois(dois):
+    '''
+    Find the records of many DOIs with a few searches of ORed DOIs.
+    Returns a dictionary of each DOI, lower-cased, and its records.
+    '''
 
-    result = get_result(search=f'recid:{recid}',
-                        fields='report_numbers')
-    try:
-        reports = result[0]['metadata']['report_numbers']
-    except KeyError:
-        return (fermilab_report, accepted)
-    for report in reports:
-        report = report['value'].upper()
-        if report.startswith('FERMILAB'):
-            fermilab_report = report
-        elif report == 'OSTI_ACCEPTED':
-            accepted = True
-    return (fermilab_report, accepted)
-
-
-def get_recid_from_doi(doi):
-    '''Find if we have a DOI.'''
-
-    recid = get_result_ids(f'doi:{doi}')
-    if recid == []:
-        recid = get_result_ids(f'doi:{doi}+_collection=Fermilab')
-    if len(recid) == 1:
-        return recid[0]
-    return None
+    wanted = set(doi.lower() for doi in dois)
+    doi_records = {}
+    ordered = sorted(wanted)
+    for start in range(0, len(ordered), DOI_CHUNK_SIZE):
+        search = ' or '.join(f'doi:"{doi}"'
+                             for doi in ordered[start:start + DOI_CHUNK_SIZE])
+        for jrec in get_result(search, fields=DOI_FIELDS):
+            recid = jrec['control_number']
+            for doi in jrec.get('dois', []):
+                doi = doi['value'].lower()
+                if doi in wanted:
+                    doi_records.setdefault(doi, {})[recid] = jrec
+    return {doi:list(jrecs.values()) for doi, jrecs in doi_records.items()}
 
 def calculate_output(numerator, denominator):
     '''Calculates a percentage.'''
@@ -92,43 +116,50 @@ def calculate_output(numerator, denominator):
         output = '{0:>8s} ({1:>7}) '.format(fraction, 'N/A')
     return output
 
-def examine(doi):
+def examine(doi, doi_records, fiscal_year):
     '''
     Checks the status of a record to see if it has a DOI
     and if it does, if it has a Fermilab report number.
     '''
 
-    if doi in DOI_REPORT_DICT:
-        return (True, DOI_REPORT_DICT[doi])
-    recid = get_recid_from_doi(doi)
-    if not recid:
-        logging.info('Need DOI')
-        logging.info('  https://doi.org/%s', doi)
+    doi_report_dict = get_doi_report_dict()
+    if doi in doi_report_dict:
+        return (True, doi_report_dict[doi])
+    jrecs = doi_records.get(doi, [])
+    if len(jrecs) != 1:
+        fiscal_year.info('Need DOI')
+        fiscal_year.info('  https://doi.org/%s', doi)
         return (False, None)
-    get_doi_prefix(doi)
-    report, accepted = get_fermilab_report(recid)
+    fiscal_year.journals[get_doi_prefix(doi)] += 1
+    view = OstiRecordView(jrecs[0])
+    recid = view.recid
+    report, accepted = view.fermilab_report, view.osti_accepted
     if not report:
-        logging.info('* Need report')
-        logging.info('  https://old.inspirehep.net/record/%s', recid)
+        fiscal_year.info('* Need report')
+        fiscal_year.info('  https://old.inspirehep.net/record/%s', recid)
         return (False, None)
     if re.match(r'.*\d$', report):
-        logging.info('* No division or section %s', report)
-        logging.info('  https://old.inspirehep.net/record/%s', recid)
+        fiscal_year.info('* No division or section %s', report)
+        fiscal_year.info('  https://old.inspirehep.net/record/%s', recid)
     if accepted:
         return (True, report)
     #if check_already_sent(recid):
     #    return (True, report)
-    logging.info('Need accepted version %s', report)
-    logging.info('  https://old.inspirehep.net/record/%s', recid)
+    fiscal_year.info('Need accepted version %s', report)
+    fiscal_year.info('  https://old.inspirehep.net/record/%s', recid)
     return (False, report)
 
-def process_dois(dois):
+def process_dois(dois, fiscal_year):
     '''Go through a list of DOIs and check our holdings.'''
 
     report_numbers_good = set()
     report_numbers_bad = set()
+    doi_report_dict = get_doi_report_dict()
+    doi_records = get_records_from_dois(doi for doi in dois
+                                        if doi.lower() not in doi_report_dict)
     for doi in dois:
-        (sent_to_osti, report) = examine(doi.lower())
+        (sent_to_osti, report) = examine(doi.lower(), doi_records,
+                                         fiscal_year)
         if not report:
             continue
         if sent_to_osti:
@@ -138,55 +169,118 @@ def process_dois(dois):
     return (report_numbers_good, report_numbers_bad)
 
 
-def main():
-    '''Examines compliance by fiscal year.'''
-
-    for year in sorted(DOIS):
-        logging.info(year)
-        (report_numbers_good, report_numbers_bad) = process_dois(DOIS[year])
-        print('Fiscal Year:', year)
-        print('Sent to OSTI:', calculate_output(len(report_numbers_good),
-                                                len(DOIS[year])))
-        for division in DIVISIONS:
-            division_good = division_bad = 0
-            for report in report_numbers_good:
-                if re.match(r'.*-' +  division + r'\b.*', report):
-                    division_good += 1
-            for report in report_numbers_bad:
-                if re.match(r'.*-' +  division + r'\b.*', report):
-                    division_bad += 1
-            print("  {0:25s} {1:>20s}".format(division,
-                  calculate_output(division_good,
-                                   division_good + division_bad)))
-            #print "  {0:25s} {1:>20s}".format(division,
-            #      calculate_output(len(report_numbers_good)-division_good,
-            #                       len(DOIS[year])-(division_good +
-            #                           division_bad)))
-
-        labwide_good = labwide_bad = 0
-        labwide_good_reports = []
-        for report in report_numbers_good:
-            if re.match(r'.*-\d+$', report):
-                labwide_good += 1
-                labwide_good_reports.append(report)
-        for report in report_numbers_bad:
-            if re.match(r'.*-\d+$', report):
-                labwide_bad += 1
-        print("  {0:25s} {1:>20s}".format('No div.',
-              calculate_output(labwide_good,
-                               labwide_good + labwide_bad)))
-        #print labwide_good_reports
-
-    JOURNALS.sort()
-    for key in Counter(JOURNALS).most_common():
+def parse_report(report):
+    '''
+    Split a report number, e.g. FERMILAB-PUB-20-001-AD-T, into its
+    (year, type, serial, divisions). A report with no division
+    or section, ending in its serial, is counted as lab-wide.
+    Reports without a year, e.g. FERMILAB-TM-2345-AD, have year None.
+    '''
+
+    year = report_type = serial = None
+    match = REPORT_PARTS_REGEX.match(report)
+    if match:
+        report_type = match.group(1)
+        if match.group(3):
+            year, serial = match.group(2), match.group(3)
+        else:
+            serial = match.group(2)
+    divisions = set()
+    for token in REPORT_TOKEN_REGEX.findall(report):
+        divisions.update(DIVISION_TOKENS.get(token, ()))
+    if LABWIDE_REGEX.match(report):
+        divisions.add(LABWIDE)
+    return ReportParts(year, report_type, serial, divisions)
+
+def tally_divisions(report_numbers_good, report_numbers_bad):
+    '''Count the good and bad reports of each division in one pass.'''
+
+    tallies = {division:{'good':0, 'bad':0}
+               for division in DIVISIONS + [LABWIDE]}
+    for reports, key in ((report_numbers_good, 'good'),
+                         (report_numbers_bad, 'bad')):
+        for report in reports:
+            for division in parse_report(report).divisions:
+                tallies[division][key] += 1
+    return tallies
+
+def process_year(year):
+    '''Check the DOIs of a fiscal year and tally the result.'''
+
+    fiscal_year = FiscalYear(year)
+    (report_numbers_good, report_numbers_bad) = process_dois(DOIS[year],
+                                                             fiscal_year)
+    fiscal_year.result = {'year':year, 'sent':len(report_numbers_good),
+                          'total':len(DOIS[year]),
+                          'divisions':tally_divisions(report_numbers_good,
+                                                      report_numbers_bad)}
+    return fiscal_year
+
+def print_year(result):
+    '''Print the compliance of a fiscal year by division.'''
+
+    print('Fiscal Year:', result['year'])
+    print('Sent to OSTI:', calculate_output(result['sent'], result['total']))
+    for division, tally in result['divisions'].items():
+        print("  {0:25s} {1:>20s}".format(division,
+              calculate_output(tally['good'], tally['good'] + tally['bad'])))
+
+def write_csv(results, filename):
+    '''One row per fiscal year and division.'''
+
+    with open(filename, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['year', 'division', 'good', 'bad'])
+        for result in results:
+            writer.writerow([result['year'], 'All', result['sent'],
+                             result['total'] - result['sent']])
+            for division, tally in result['divisions'].items():
+                writer.writerow([result['year'], division,
+                                 tally['good'], tally['bad']])
+
+def write_json(results, filename):
+    '''The results as a list of fiscal years.'''
+
+    with open(filename, 'w') as output:
+        json.dump(results, output, indent=2)
+
+def main(csv_file=None, json_file=None, workers=1):
+    '''
+    Examines compliance by fiscal year.
+    With more than one worker the fiscal years are checked concurrently;
+    the output is still in fiscal year order.
+    '''
+
+    get_doi_report_dict()
+    results = []
+    journals = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for fiscal_year in executor.map(process_year, sorted(DOIS)):
+            for message in fiscal_year.messages:
+                logging.info(message)
+            print_year(fiscal_year.result)
+            results.append(fiscal_year.result)
+            journals.update(fiscal_year.journals)
+
+    for key in sorted(journals.items(), key=lambda item: (-item[1], item[0])):
         logging.info('{0:30s} {1:>4d}'.format(key[0], key[1]))
 
+    if csv_file:
+        write_csv(results, csv_file)
+    if json_file:
+        write_json(results, json_file)
     print(LOGFILE)
 
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--csv', help='Also write the tallies as CSV')
+    parser.add_argument('-j', '--json', help='Also write the tallies as JSON')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Fiscal years to check at the same time')
+    args = parser.parse_args()
     try:
-        main()
+        main(args.csv, args.json, args.workers)
     except KeyboardInterrupt:
         print('Exiting')
@@ -13,13 +13,15 @@ from os import path
 import datetime
 import shutil
 import sys
+from functools import cached_property, lru_cache
 
-from authors import get_orcid_from_author
+from authors import get_author_names, get_orcid_from_author
+import inspire_api
 from inspire_api import get_result, get_result_ids
 from check_url import get_url_check_accepted, get_pdf_from_url
 from osti_accepteds import check_in_accepteds,\
                            retrieve_accepteds, store_accepteds
-from osti_web_service_constants import TYPE_DICT, \
+from osti_web_service_constants import TYPE_DICT, TYPE_PRECEDENCE, \
         DOE_SUBJECT_CATEGORIES_DICT, \
         DOE_FERMILAB_DICT, DOE_AFF_DICT, \
         INSPIRE_AFF_DICT
@@ -30,10 +32,25 @@ from osti_web_service_search_constants import SEARCH_DEFAULT, SEARCH_DATE, \
 TEST = True
 TEST = False
 LOGFILE = 'osti_web_service.log'
+SYNC_FILE = 'osti_web_service_sync.txt'
 VERBOSE = True
 VERBOSE = False
 ENDING_COUNTER = 20
 
+TYPE_REGEX = re.compile(r'FERMILAB-(' +
+                        '|'.join(re.escape(key) for key in
+                                 sorted(TYPE_DICT, key=len, reverse=True)) +
+                        ')')
+TYPE_RANK = {key: rank for rank, key in enumerate(TYPE_PRECEDENCE)}
+if set(TYPE_RANK) != set(TYPE_DICT):
+    raise ValueError('TYPE_PRECEDENCE and TYPE_DICT differ in: ' +
+                     ', '.join(sorted(set(TYPE_RANK) ^ set(TYPE_DICT))))
+#Lookahead so that overlapping keys in a term are all found
+SUBJECT_CATEGORIES_REGEX = re.compile(
+    '(?=(' + '|'.join(re.escape(key) for key in DOE_SUBJECT_CATEGORIES_DICT)
+    + '))')
+AFFILIATION_INDEX = {}
+
 def create_osti_id_pdf(jrec=None, recid=None, osti_id=None,
                        doi=None, reports=None):
     '''
@@ -193,36 +210,13 @@ def get_author_details(jrec, authors):
         paper_authors = jrec['authors']
     except KeyError:
         return None
-    for item in paper_authors:
+    names = get_author_names(paper_authors)
+    for item, name in zip(paper_authors, names):
+        first_name, middle_name, last_name = name
         authors_detail = ET.SubElement(authors, 'authors_detail')
-        author = None
-        last_name = None
-        first_name = None
-        middle_name = None
         affiliation = None
         email = None
         orcid = None
-        try:
-            author = item['full_name']
-            try:
-                matchobj = re.match(r'(.*)\, (.*)\, (.*)', author)
-                last_name = matchobj.group(1)
-                fore_name = matchobj.group(2)
-                title = matchobj.group(3)
-                fore_name = fore_name + ', ' + title
-            except AttributeError:
-                last_name = re.sub(r'\,.*', '', author)
-                fore_name = re.sub(r'.*\, ', '', author)
-            if re.search(r' ', fore_name):
-                first_name = re.sub(r' .*', '', fore_name)
-                middle_name = re.sub(r'.* ', '', fore_name)
-            elif re.search(r'^\w\.\w\.', fore_name):
-                first_name = re.sub(r'^(\w\.).*', r'\1', fore_name)
-                middle_name = re.sub(r'^\w\.', '', fore_name)
-            else:
-                first_name = fore_name
-        except KeyError:
-            pass
         try:
             affiliation = '; '.join([x['value'] for x in item['affiliations']])
         except KeyError:
@@ -235,7 +229,7 @@ def get_author_details(jrec, authors):
         try:
             for id_num in item['ids']:
                 if id_num['schema'] == 'ORCID':
-                    orcid = re.sub(r'ORCID:', '', id_num['value'])
+                    orcid = id_num['value'].replace('ORCID:', '')
         except KeyError:
             pass
         if orcid is None:
@@ -324,17 +318,32 @@ def get_reports(jrec):
 
 def get_product_type(jrec):
     '''Get product type in OSTI format.'''
-    type_dict = TYPE_DICT
+
     product_type = '??'
-    report_string = get_reports(jrec)
-    for key in type_dict:
-        pattern = 'FERMILAB-' + key
-        if re.search(pattern, report_string):
-            product_type = type_dict[key]
+    keys = set()
+    try:
+        for report in jrec['report_numbers']:
+            keys.update(TYPE_REGEX.findall(report['value']))
+    except KeyError:
+        pass
+    if keys:
+        product_type = TYPE_DICT[max(keys, key=TYPE_RANK.get)]
     if VERBOSE:
         print(product_type)
     return product_type
 
+def get_product_types(jrecs):
+    '''Get the OSTI product type for a batch of records, keyed on recid.'''
+
+    return {jrec['control_number']: get_product_type(jrec) for jrec in jrecs}
+
+@lru_cache(maxsize=None)
+def get_subject_category_codes(term):
+    '''Convert one INSPIRE subject term to a tuple of OSTI codes.'''
+
+    return tuple(DOE_SUBJECT_CATEGORIES_DICT[key] for key in
+                 dict.fromkeys(SUBJECT_CATEGORIES_REGEX.findall(term.lower())))
+
 def get_subject_categories(jrec):
     '''Convert INSPIRE subject codes to OSTI codes.'''
 
@@ -342,35 +351,47 @@ def get_subject_categories(jrec):
         categories = jrec['inspire_categories']
     except KeyError:
         return None
-    osti_categories = []
+    osti_categories = set()
     for category in categories:
-        for key in DOE_SUBJECT_CATEGORIES_DICT:
-            if re.search(key, category['term'].lower()):
-                osti_categories.append(DOE_SUBJECT_CATEGORIES_DICT[key])
-    return '; '.join(c for c in set(osti_categories))
+        osti_categories.update(get_subject_category_codes(category['term']))
+    return '; '.join(sorted(osti_categories))
 
-def get_affiliations(jrec, long_flag):
-    '''Get affiliations using OSTI institution names.'''
+def get_affiliation_index(jrec):
+    '''
+    Get the DOE codes of the known institutions on a record.
+    The index is computed once per record and shared by all callers.
+    '''
 
+    recid = jrec.get('control_number')
+    if recid in AFFILIATION_INDEX:
+        return AFFILIATION_INDEX[recid]
     affiliations = set(['Fermilab'])
-    paper_authors = None
-    try:
-        paper_authors = jrec['authors']
-        for author in paper_authors:
-            if not 'affiliations' in author:
-                continue
-            for affiliation in author['affiliations']:
+    for author in jrec.get('authors', []):
+        for affiliation in author.get('affiliations', []):
+            if affiliation.get('value') in INSPIRE_AFF_DICT:
                 affiliations.add(affiliation['value'])
-    except KeyError:
-        pass
-    doe_affs = []
-    doe_affs_long = []
-    for aff in affiliations:
-        if aff in INSPIRE_AFF_DICT:
-            doe_affs.append(INSPIRE_AFF_DICT[aff])
-            doe_affs_long.append(DOE_AFF_DICT[INSPIRE_AFF_DICT[aff]])
+        #Stop once every known institution has turned up
+        if len(affiliations) == len(INSPIRE_AFF_DICT):
+            break
+    doe_affs = [INSPIRE_AFF_DICT[aff] for aff in INSPIRE_AFF_DICT
+                if aff in affiliations]
+    #Records fetched with a restricted field list are not cached
+    if recid is not None and 'authors' in jrec:
+        AFFILIATION_INDEX[recid] = doe_affs
+    return doe_affs
+
+def get_affiliation_indexes(jrecs):
+    '''Get the affiliation index for a batch of records, keyed on recid.'''
+
+    return {jrec['control_number']: get_affiliation_index(jrec)
+            for jrec in jrecs}
+
+def get_affiliations(jrec, long_flag):
+    '''Get affiliations using OSTI institution names.'''
+
+    doe_affs = get_affiliation_index(jrec)
     if long_flag:
-        return '; '.join(doe_affs_long)
+        return '; '.join(DOE_AFF_DICT[aff] for aff in doe_affs)
     return '; '.join(doe_affs)
 
 def get_eprint(jrec):
@@ -407,6 +428,135 @@ def get_date(jrec, product_type):
                 date = '01/01/' + str(date)
     return date
 
+class OstiRecordView:
+    '''
+    The fields of an INSPIRE record that the OSTI scripts use.
+    Each field is read from the record the first time it is used and
+    kept, so a script pays only for the fields it reads.
+    '''
+
+    def __init__(self, jrec):
+        self.jrec = jrec
+        self.recid = jrec.get('control_number')
+
+    @cached_property
+    def osti_id(self):
+        return get_osti_id(self.jrec)
+
+    @cached_property
+    def url_check(self):
+        '''The url and whether OSTI has accepted it, found together.'''
+
+        return get_url_check_accepted(self.jrec)
+
+    @property
+    def url(self):
+        return self.url_check[0]
+
+    @property
+    def accepted(self):
+        return self.url_check[1]
+
+    @cached_property
+    def title(self):
+        if 'titles' in self.jrec:
+            return get_title(self.jrec)
+        return None
+
+    @cached_property
+    def pubnote(self):
+        '''Publication information in the order get_pubnote returns it.'''
+
+        return get_pubnote(self.jrec)
+
+    @property
+    def journal(self):
+        return self.pubnote[0]
+
+    @property
+    def volume(self):
+        return self.pubnote[1]
+
+    @property
+    def issue(self):
+        return self.pubnote[2]
+
+    @property
+    def pages(self):
+        return self.pubnote[3]
+
+    @property
+    def doi(self):
+        return self.pubnote[4]
+
+    @cached_property
+    def eprint(self):
+        return get_eprint(self.jrec)
+
+    @cached_property
+    def reports(self):
+        return get_reports(self.jrec)
+
+    @cached_property
+    def report_flags(self):
+        '''The Fermilab report number and the OSTI_ACCEPTED flag.'''
+
+        fermilab_report = None
+        osti_accepted = False
+        for report in self.jrec.get('report_numbers', []):
+            report = report['value'].upper()
+            if report.startswith('FERMILAB'):
+                fermilab_report = report
+            elif report == 'OSTI_ACCEPTED':
+                osti_accepted = True
+        return fermilab_report, osti_accepted
+
+    @property
+    def fermilab_report(self):
+        return self.report_flags[0]
+
+    @property
+    def osti_accepted(self):
+        return self.report_flags[1]
+
+    @cached_property
+    def product_type(self):
+        return get_product_type(self.jrec)
+
+    @cached_property
+    def author_number(self):
+        return get_author_number(self.jrec)
+
+    @cached_property
+    def author_first(self):
+        if self.author_number:
+            return get_author_first(self.jrec)
+        return None
+
+    @cached_property
+    def corporate_author(self):
+        return get_corporate_author(self.jrec)
+
+    @cached_property
+    def collaborations(self):
+        return get_collaborations(self.jrec)
+
+    @cached_property
+    def abstract(self):
+        return get_abstract(self.jrec)
+
+    @cached_property
+    def affiliations(self):
+        return get_affiliations(self.jrec, True)
+
+    @cached_property
+    def language(self):
+        return get_language(self.jrec)
+
+    @cached_property
+    def subject_categories(self):
+        return get_subject_categories(self.jrec)
+
 def prettify(elem):
     '''Return a pretty-printed XML string for the Element.'''
 
@@ -422,21 +572,21 @@ def create_xml(jrec, records):
     If an accepted version has already been submitted, returns None.
     '''
 
-    url, accepted = get_url_check_accepted(jrec)
+    view = OstiRecordView(jrec)
+    url, accepted = view.url, view.accepted
     if VERBOSE:
         print(url, accepted)
     if url is None:
         if get_report_hidden(jrec):
-            eprint = get_eprint(jrec)
-            if eprint:
-                url = f'https://arxiv.org/pdf/{eprint}.pdf'
+            if view.eprint:
+                url = f'https://arxiv.org/pdf/{view.eprint}.pdf'
         else:
             return None
-    osti_id = get_osti_id(jrec)
+    osti_id = view.osti_id
     if check_in_accepteds(osti_id):
         return None
-    recid = jrec['control_number']
-    product_type = get_product_type(jrec)
+    recid = view.recid
+    product_type = view.product_type
     if accepted:
         product_type = 'JA'
     ##journal_info = get_pubnote(jrec)
@@ -472,33 +622,29 @@ def create_xml(jrec, records):
     ET.SubElement(access_limitation, 'unl')
     if not accepted:
         ET.SubElement(record, 'site_url').text = url
-    ET.SubElement(record, 'title').text = get_title(jrec)
-    collaborations = get_collaborations(jrec)
-    author_number = get_author_number(jrec)
+    ET.SubElement(record, 'title').text = view.title
 
-    corporate_author = get_corporate_author(jrec)
-    if corporate_author:
+    if view.corporate_author:
         author = ET.SubElement(record, 'author')
-        author.text = corporate_author
+        author.text = view.corporate_author
 
-    elif author_number > 20:
+    elif view.author_number > 20:
         author = ET.SubElement(record, 'author')
-        author_first = get_author_first(jrec)
-        if author_first:
-            author.text = get_author_first(jrec)
+        if view.author_first:
+            author.text = view.author_first
     else:
         authors = ET.SubElement(record, 'authors')
         get_author_details(jrec, authors)
     ET.SubElement(record, 'contributor_organizations').text = \
-        collaborations
-    reports = get_reports(jrec)
+        view.collaborations
+    reports = view.reports
     ET.SubElement(record, 'report_nos').text = reports
     for key in DOE_FERMILAB_DICT:
         ET.SubElement(record, key).text = DOE_FERMILAB_DICT[key]
-    ET.SubElement(record, 'description').text = get_abstract(jrec)
+    ET.SubElement(record, 'description').text = view.abstract
     ET.SubElement(record, 'originating_research_org').text = \
-        get_affiliations(jrec, True)
-    journal_info = get_pubnote(jrec)
+        view.affiliations
+    journal_info = view.pubnote
     if product_type == 'JA' and journal_info[0] is None:
         journal_elements = ['journal_name']
         journal_info = ['TBD']
@@ -520,10 +666,9 @@ def create_xml(jrec, records):
         f'oai:inspirehep.net:{recid}'
     ET.SubElement(record, 'publication_date').text = \
         get_date(jrec, product_type)
-    ET.SubElement(record, 'language').text = \
-        get_language(jrec)
+    ET.SubElement(record, 'language').text = view.language
     ET.SubElement(record, 'subject_category_code').text = \
-        get_subject_categories(jrec)
+        view.subject_categories
     ET.SubElement(record, 'released_date').text = \
         datetime.datetime.now().strftime('%m/%d/%Y')
           #CHICAGO_TIMEZONE.fromutc(datetime.datetime.utcnow()).\
@@ -536,9 +681,13 @@ def main(result):
     '''Generate OSTI posting from a recid or an INSPIRE search.'''
 
     counter = 0
-    if not result:
+    complete = True
+    if result is None:
         print("No, that search did not work")
         return None
+    if not result:
+        print('No result found')
+        return True
     filename = 'tmp_' + __file__
     filename = re.sub(r'.*\/', '', filename)
     filename = re.sub('.py', '.out', filename)
@@ -548,6 +697,7 @@ def main(result):
     records = ET.Element('records')
     for jrec in result:
         if counter > ENDING_COUNTER:
+            complete = False
             break
         if check_already_sent(jrec):
             if VERBOSE:
@@ -563,9 +713,39 @@ def main(result):
         output.write(prettify(records))
     output.close()
     print("Number of records:", counter)
+    return complete
+
+def get_sync_date():
+    '''Get the date of the last complete incremental run.'''
+
+    try:
+        with open(SYNC_FILE, 'r') as sync_file:
+            return sync_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def store_sync_date(sync_date):
+    '''Record the date that the next incremental run starts from.'''
+
+    with open(SYNC_FILE, 'w') as sync_file:
+        sync_file.write(sync_date + '\n')
+
+def get_incremental_search(end_date):
+    '''
+    Search for records added or updated since the last complete
+    incremental run. Without one it falls back to the full search.
+    '''
+
+    sync_date = get_sync_date()
+    if not sync_date:
+        return SEARCH_DEFAULT
+    return f'{SEARCH_FNAL} du:{sync_date}->{end_date} -{SEARCH_OSTI}'
 
 def find_result(search_input=None):
-    ''' Finds records to send email to. '''
+    '''
+    Finds records to send email to: a list, empty if the search
+    found nothing, or None if the search was badly formed.
+    '''
 
     if not search_input:
         search_input = input('Your search? ').lower()
@@ -589,9 +769,7 @@ def find_result(search_input=None):
                     + str(len(result)) + '\n'
         log.write(date_time_stamp)
         log.close()
-        return result
-    print('No result found')
-    return None
+    return result
 
 def get_new_accepteds():
     '''Find the new accepted PDFs'''
@@ -617,6 +795,7 @@ if __name__ == '__main__':
 
     RESULT = None
     SEARCH = SEARCH_DEFAULT
+    SYNC_DATE = None
     parser = argparse.ArgumentParser()
     parser.add_argument('-a', '--accepted',
                         help='Look for new accepted manuscripts',
@@ -624,6 +803,12 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--include',
                         help='Include records that already have an OSTI ID',
                         action='store_true')
+    parser.add_argument('-m', '--mirror',
+                        help='Use the local INSPIRE mirror where possible',
+                        action='store_true')
+    parser.add_argument('-n', '--incremental',
+                        help='Only records added or updated since last run',
+                        action='store_true')
     parser.add_argument('-r', '--record', type=int,
                         help='Run on a single record')
     parser.add_argument('-s', '--search',
@@ -636,10 +821,15 @@ if __name__ == '__main__':
                         help='Run in verbose mode',
                         action='store_true')
     args = parser.parse_args()
+    if args.mirror:
+        inspire_api.MIRROR = True
     if args.accepted:
         RESULT = get_new_accepteds()
     if args.include:
         pass
+    if args.incremental and not (args.record or args.search):
+        SYNC_DATE = datetime.date.today().isoformat()
+        SEARCH = get_incremental_search(SYNC_DATE)
     if args.record:
         SEARCH = f'recid:{args.record}'
     if args.search:
@@ -648,9 +838,19 @@ if __name__ == '__main__':
         TEST = True
     if args.verbose:
         VERBOSE = True
-    if not RESULT:
+    if RESULT:
+        SYNC_DATE = None
+    else:
         RESULT = find_result(SEARCH)
     try:
-        main(RESULT)
+        if SYNC_DATE and RESULT == []:
+            #Nothing added or updated, so the run is complete
+            print('Nothing new since the last run')
+            COMPLETE = True
+        else:
+            COMPLETE = main(RESULT)
+        #Only move the high-water mark once every record has been written
+        if COMPLETE and SYNC_DATE and not TEST:
+            store_sync_date(SYNC_DATE)
     except KeyboardInterrupt:
         print('Exiting')
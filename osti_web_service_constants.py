@@ -60,6 +60,18 @@ TYPE_DICT = {
 'VLHCPUB':'TR'
 }
 
+#A record can carry several Fermilab report numbers, e.g. a THESIS
+#that was also issued as a PUB. The type listed last here wins.
+#This is the legacy order, the order TYPE_DICT lists its keys in, which
+#used to decide; it is not a considered ranking (e.g. THESIS beats PUB).
+#It must hold exactly the TYPE_DICT keys; osti_web_service checks this.
+TYPE_PRECEDENCE = [
+'ANNUAL', 'BACHELORS', 'BOOK', 'CONF', 'CRADA', 'D0-EN', 'DESIGN',
+'FACTSHEET', 'FN', 'HABILITATION', 'INDUSTRIAL', 'LOI', 'LU', 'MASTERS',
+'MISC', 'MONTHLY', 'MICROBOONE', 'MUCOOL', 'PLAN', 'POSTER', 'PROPOSAL',
+'PUB', 'REVIEW', 'SLIDES', 'THESIS', 'TM', 'VLHCPUB'
+]
+
 DOE_SUBJECT_CATEGORIES_DICT = {
 'acc':'43 PARTICLE ACCELERATORS',
 'ins':'46 INSTRUMENTATION RELATED TO NUCLEAR SCIENCE AND TECHNOLOGY',
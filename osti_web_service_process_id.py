@@ -5,12 +5,16 @@
 Script for adding OSTI IDs to INSPIRE records after using OSTI Web Service.
 """
 
+import argparse
+import hashlib
+import json
 import re
 import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from itertools import islice
 
-from inspire_api import get_result, get_result_ids
-from osti_web_service import create_osti_id_pdf, get_pubnote
-from osti_fermilab_accepted_report import get_fermilab_report
+from inspire_api import get_result
+from osti_web_service import create_osti_id_pdf, OstiRecordView
 
 TEST = False
 #TEST = True
@@ -20,8 +24,16 @@ VERBOSE = True
 
 if TEST:
     DOCUMENT = 'tmp_osti_test.out'
+#Outcome of each (osti_id, recid) pair, so reruns over the same
+#response skip finished pairs. Its first line holds the response's hash.
+LEDGER_FILE = DOCUMENT + '.ledger'
+DONE_OUTCOMES = ('appended', 'present')
 
 RECIDS = []
+#OSTI records checked per round of INSPIRE searches
+BATCH_SIZE = 50
+RECORD_FIELDS = ('control_number', 'dois', 'documents',
+                 'external_system_identifiers', 'report_numbers', 'urls')
 
 
 def print_rec(osti_id, recid):
@@ -35,69 +47,171 @@ def print_rec(osti_id, recid):
   </datafield>
 </record>'''
 
+def get_batch_details(pairs):
+    """
+    Look up a batch of (osti_id, recid) pairs with two searches.
+    Returns the Fermilab records keyed on recid and, for each OSTI ID,
+    the recids that already carry it.
+    """
+
+    recids = sorted(set(recid for _, recid in pairs))
+    search = '_collections:Fermilab ('
+    search += ' or '.join(f'recid:{recid}' for recid in recids) + ')'
+    jrecs = {}
+    for jrec in get_result(search, fields=RECORD_FIELDS):
+        jrecs[str(jrec['control_number'])] = jrec
+    osti_ids = sorted(set(osti_id for osti_id, _ in pairs))
+    search = '_collections:Fermilab external_system_identifiers.schema:osti ('
+    search += ' or '.join(f'external_system_identifiers.value:{osti_id}'
+                          for osti_id in osti_ids) + ')'
+    owners = {}
+    for jrec in get_result(search, fields=('control_number',
+                                           'external_system_identifiers')):
+        for identifier in jrec.get('external_system_identifiers', []):
+            if identifier['schema'].lower() == 'osti' and \
+               identifier['value'] in osti_ids:
+                owners.setdefault(identifier['value'], []).append(
+                    str(jrec['control_number']))
+    return jrecs, owners
+
+def create_xml_batch(pairs, dry_run=False):
+    """
+    Checks a batch of (osti_id, recid) pairs from an OSTI response.
+    Returns an (outcome, record) pair for each: the record to append,
+    or None if there is nothing to add and False if there is a problem.
+    A dry run does not fetch accepted PDFs.
+    """
+
+    pairs = [(str(osti_id), str(recid).replace('oai:inspirehep.net:', ''))
+             for osti_id, recid in pairs]
+    jrecs, owners = get_batch_details(pairs)
+    updates = []
+    for osti_id, recid in pairs:
+        if recid not in jrecs:
+            print(f'No such INSPIRE Fermilab record {recid}')
+            updates.append(('missing', None))
+            continue
+        jrec = jrecs[recid]
+        view = OstiRecordView(jrec)
+        if not dry_run:
+            create_osti_id_pdf(jrec, recid, osti_id, view.doi,
+                               view.fermilab_report)
+        result_osti = owners.get(osti_id, [])
+        if len(result_osti) == 1:
+            print(f'OSTI ID {osti_id} already on {result_osti[0]}')
+            updates.append(('present', None))
+            continue
+        if view.osti_id:
+            print(f'Problem with {recid} {osti_id}')
+            print(f'  {recid} already has OSTI ID {view.osti_id}')
+            updates.append(('error', False))
+            continue
+        updates.append(('appended', print_rec(osti_id, recid)))
+    return updates
+
 def create_xml(osti_id, recid):
     """
     The function checks if the OSTI ID should be added to INSPIRE.
     If so, it builds up that information.
     """
 
-    osti_id = str(osti_id)
-    recid = str(recid)
-    recid = recid.replace('oai:inspirehep.net:', '')
-    search = f'_collections:Fermilab recid:{recid}'
-    result = get_result(search)
-    if len(result) == 0:
-        print(f'No such INSPIRE Fermilab record {recid}')
-        return None
-    jrec = result[0]
-    report = get_fermilab_report(recid)[0]
-    doi = get_pubnote(jrec)[4]
-    create_osti_id_pdf(jrec, recid, osti_id, doi, report)
-    search = '_collections:Fermilab '
-    search += f'external_system_identifiers.value:{osti_id} '
-    search += 'external_system_identifiers.schema:osti'
-    result_osti = get_result_ids(search)
-    if result_osti == recid:
-        return None
-    if len(result_osti) == 1:
-        print(f'OSTI ID {osti_id} already on {result_osti[0]}')
-        return None
-    search = f'recid:{recid} -external_system_identifiers.schema:osti'
-    if TEST:
-        print(search)
-    result = get_result_ids(search)
-    if len(result) != 1:
-        print(f'Problem with {recid} {osti_id}')
-        print(f'  {search} {result}')
-        return False
-    if TEST:
-        print(result)
-    return print_rec(osti_id, recid)
-
-
-def main():
+    return create_xml_batch([(osti_id, recid)])[0][1]
+
+
+def iter_osti_records(document):
     """
-    Takes the output from an OSTI web push and appends the
-    OSTI IDs to the INSPIRE records.
+    Stream (osti_id, recid) pairs from an OSTI response, clearing
+    each <record> once it has been read so memory stays bounded.
     """
 
-    filename = 'tmp_' + __file__
-    filename = re.sub('.py', '_append.out', filename)
-    output = open(filename, 'w')
-    output.write('<collection>')
-    tree = ET.parse(DOCUMENT)
-    root = tree.getroot()
-    for record in root.findall('record'):
-        print(record.tag)
-        osti_id = record.find('osti_id').text
+    root = None
+    for event, element in ET.iterparse(document, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event != 'end' or element.tag != 'record':
+            continue
+        print(element.tag)
+        osti_id = element.findtext('osti_id')
+        recid = element.findtext('other_identifying_nos')
+        root.clear()
         if VERBOSE:
             print(osti_id)
         if osti_id == '0':
             continue
-        recid = record.find('other_identifying_nos').text
         if VERBOSE:
             print(recid)
-        record_update = create_xml(osti_id, recid)
+        yield (osti_id, recid.replace('oai:inspirehep.net:', ''))
+
+@contextmanager
+def open_collection(filename):
+    """Write records to a <collection> file as they are produced."""
+
+    with open(filename, 'w') as output:
+        output.write('<collection>')
+        yield output
+        output.write('</collection>')
+
+def get_document_hash(document):
+    """Fingerprint of an OSTI response, tying the ledger to it."""
+
+    digest = hashlib.sha256()
+    with open(document, 'rb') as response:
+        for chunk in iter(lambda: response.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_ledger(document_hash):
+    """
+    Outcomes of earlier runs over the same response, keyed on
+    (osti_id, recid). Returns None if the ledger is missing or was
+    left by another response, which must then be started afresh.
+    """
+
+    ledger = {}
+    matched = False
+    try:
+        with open(LEDGER_FILE, 'r') as ledger_file:
+            for line in ledger_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    #Last line of an interrupted run
+                    continue
+                if 'document' in entry:
+                    matched = entry['document'] == document_hash
+                    if not matched:
+                        return None
+                    continue
+                ledger[(entry['osti_id'], entry['recid'])] = entry['outcome']
+    except FileNotFoundError:
+        return None
+    if not matched:
+        return None
+    return ledger
+
+def write_ledger(ledger_file, osti_id, recid, outcome):
+    """Record the outcome for a pair as soon as it is known."""
+
+    ledger_file.write(json.dumps({'osti_id':osti_id, 'recid':recid,
+                                  'outcome':outcome}) + '\n')
+    ledger_file.flush()
+
+def process_batch(batch, ledger, output, ledger_file):
+    """
+    Append the OSTI IDs for a batch of pairs.
+    Pairs appended in an earlier run are written again from the ledger,
+    pairs found already present are skipped, the rest are looked up.
+    """
+
+    todo = [pair for pair in batch if ledger.get(pair) not in DONE_OUTCOMES]
+    results = dict(zip(todo, create_xml_batch(todo) if todo else []))
+    for osti_id, recid in batch:
+        if (osti_id, recid) in results:
+            outcome, record_update = results[(osti_id, recid)]
+        elif ledger[(osti_id, recid)] == 'appended':
+            outcome, record_update = None, print_rec(osti_id, recid)
+        else:
+            continue
         if record_update:
             try:
                 if TEST:
@@ -105,13 +219,69 @@ def main():
                 else:
                     output.write(record_update)
             except IOError:
-                print(f'CANNOT print record {record.attrib}')
-    output.write('</collection>')
-    output.close()
+                print(f'CANNOT print record {osti_id} {recid}')
+                continue
+        if outcome and not TEST:
+            write_ledger(ledger_file, osti_id, recid, outcome)
+
+def dry_run_batch(batch, ledger):
+    """Print what a real run would append for a batch of pairs."""
+
+    todo = [pair for pair in batch if ledger.get(pair) not in DONE_OUTCOMES]
+    if not todo:
+        return 0
+    count = 0
+    for (osti_id, recid), (outcome, _) in \
+        zip(todo, create_xml_batch(todo, dry_run=True)):
+        if outcome == 'appended':
+            print(f'+ {recid} {osti_id}')
+            count += 1
+    return count
+
+def main(dry_run=False):
+    """
+    Takes the output from an OSTI web push and appends the
+    OSTI IDs to the INSPIRE records.
+    """
+
+    filename = 'tmp_' + re.sub(r'.*\/', '', __file__)
+    filename = re.sub('.py', '_append.out', filename)
+    pairs = iter_osti_records(DOCUMENT)
+    document_hash = get_document_hash(DOCUMENT)
+    ledger = read_ledger(document_hash)
+    ledger_mode = 'a'
+    if ledger is None:
+        ledger = {}
+        ledger_mode = 'w'
+    if dry_run:
+        count = 0
+        while True:
+            batch = list(islice(pairs, BATCH_SIZE))
+            if not batch:
+                break
+            count += dry_run_batch(batch, ledger)
+        print(f'{count} OSTI IDs would be appended')
+        return
+    with open_collection(filename) as output, \
+         open(LEDGER_FILE, ledger_mode) as ledger_file:
+        if ledger_mode == 'w':
+            ledger_file.write(json.dumps({'document':document_hash}) + '\n')
+            ledger_file.flush()
+        while True:
+            batch = list(islice(pairs, BATCH_SIZE))
+            if not batch:
+                break
+            process_batch(batch, ledger, output, ledger_file)
 
 
 if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dry-run',
+                        help='Show what would be appended, change nothing',
+                        action='store_true')
+    args = parser.parse_args()
     try:
-        main()
+        main(args.dry_run)
     except KeyboardInterrupt:
         print('Exiting')